@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-call overhead of resolving the Graphviz backend: the original
+import-and-which on every render versus the backend probed once at startup.
+With a dot binary installed it also times full renders, including the syntax
+error path that used to render twice, and libgvc worker renders when the
+Graphviz libraries are available.
+
+Usage:
+    python bench/bench_graphviz_backend.py
+"""
+import os
+import shutil
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mcp_diagram_server as server  # noqa: E402
+
+
+def original_probe():
+    """The lookups the previous render_graphviz repeated on every call"""
+    try:
+        from graphviz import Source  # noqa: F401
+    except Exception:
+        pass
+    return shutil.which('dot')
+
+
+def original_render(dot_src, format='svg'):
+    """The previous implementation: python-graphviz first, dot binary on any failure"""
+    try:
+        from graphviz import Source
+        return Source(dot_src).pipe(format=format)
+    except Exception:
+        dot_bin = shutil.which('dot')
+        if not dot_bin:
+            raise RuntimeError('graphviz not available: install python-graphviz or dot binary')
+        p = subprocess.Popen([dot_bin, f'-T{format}'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate(dot_src.encode('utf-8'))
+        if p.returncode != 0:
+            raise RuntimeError(f'dot failed: {err.decode()}')
+        return out
+
+
+def bench(fn):
+    number, total = timeit.Timer(fn).autorange()
+    return total / number * 1e6
+
+
+def failing(fn):
+    def call():
+        try:
+            fn()
+        except Exception:
+            pass
+    return call
+
+
+def main():
+    backend = server.graphviz_backend()
+    print(f"backend: {backend.kind} {backend.path or ''} ({backend.version})")
+    print(f"{'backend resolution':<24} {'original us':>12} {'resolved us':>12}")
+    print(f"{'per call':<24} {bench(original_probe):>12.2f} {bench(server.graphviz_backend):>12.2f}")
+    if backend.kind != 'dot':
+        print("no dot binary found: skipping render timings")
+        return
+
+    good = 'digraph G { a -> b; b -> c; c -> a }'
+    bad = 'digraph G { a -> }'
+    print(f"{'render':<24} {'original us':>12} {'resolved us':>12}")
+    for label, src in (('valid DOT', good), ('syntax error', bad)):
+        original = bench(failing(lambda: original_render(src)))
+        resolved = bench(failing(lambda: server.render_graphviz(src, format='svg')))
+        print(f"{label:<24} {original:>12.0f} {resolved:>12.0f}")
+
+    try:
+        lib = server.LibGVC()
+    except OSError as e:
+        print(f"libgvc not loadable ({e}): skipping libgvc timings")
+        return
+    print(f"{'small graph render':<24} {'dot proc us':>12} {'libgvc us':>12}")
+    for label, src in (('3 nodes', good), ('syntax error', bad)):
+        dot = bench(failing(lambda: server.render_graphviz(src, format='svg')))
+        inproc = bench(failing(lambda: lib.render(src, format='svg')))
+        print(f"{label:<24} {dot:>12.0f} {inproc:>12.0f}")
+    lib.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the PlantUML text encoder: the original per-byte Python loop
+versus base64 + bytes.translate, across input sizes.
+
+Usage:
+    python bench/bench_plantuml_encoder.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'test'))
+import mcp_diagram_server as server  # noqa: E402
+from test_plantuml_encoder import reference_encode  # noqa: E402
+
+# The loop keeps every bit in one ever-growing int, so it is quadratic in the
+# input size; larger sizes only make the reference run take minutes.
+SIZES = [64, 1024, 16 * 1024, 64 * 1024]
+
+
+def bench(fn, data):
+    number, total = timeit.Timer(lambda: fn(data)).autorange()
+    return total / number
+
+
+def main():
+    print(f"{'bytes':>10} {'loop us':>12} {'translate us':>14} {'speedup':>9}")
+    for size in SIZES:
+        data = os.urandom(size)
+        assert server._plantuml_encode(data) == reference_encode(data)
+        loop = bench(reference_encode, data)
+        fast = bench(server._plantuml_encode, data)
+        print(f"{size:>10} {loop * 1e6:>12.1f} {fast * 1e6:>14.1f} {loop / fast:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Benchmark plantuml_text_to_server_key: the original double compression versus
+a single raw-deflate pass at several levels, plus memoized repeat lookups.
+
+Usage:
+    python bench/bench_plantuml_key.py
+"""
+import os
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mcp_diagram_server as server  # noqa: E402
+
+
+def original_key(text):
+    """The previous implementation, including its discarded zlib.compress pass"""
+    zlib.compress(text.encode('utf-8'))
+    comp = zlib.compressobj(level=9, wbits=-15)
+    raw = comp.compress(text.encode('utf-8')) + comp.flush()
+    return server._plantuml_encode(raw)
+
+
+def sequence_diagram(messages):
+    lines = ['@startuml']
+    for i in range(messages):
+        lines.append(f'Service{i % 17} -> Service{(i * 7) % 23}: request {i} with payload {i * 31 % 1000}')
+        lines.append(f'Service{(i * 7) % 23} --> Service{i % 17}: response {i}')
+    lines.append('@enduml')
+    return '\n'.join(lines)
+
+
+def bench(fn):
+    number, total = timeit.Timer(fn).autorange()
+    return total / number * 1e6
+
+
+def main():
+    print(f"{'source':>10} {'original us':>12} {'lvl9 us':>9} {'lvl6 us':>9} {'lvl1 us':>9} "
+          f"{'memo us':>8} {'key len 9/6/1':>18}")
+    for messages in (5, 100, 2000, 20000):
+        text = sequence_diagram(messages)
+        original = bench(lambda: original_key(text))
+        levels = {}
+        for level in (9, 6, 1):
+            levels[level] = bench(lambda: server._server_key.__wrapped__(text, level))
+        server.plantuml_text_to_server_key(text)
+        memo = bench(lambda: server.plantuml_text_to_server_key(text))
+        lengths = '/'.join(str(len(server._server_key.__wrapped__(text, lvl))) for lvl in (9, 6, 1))
+        print(f"{len(text):>10} {original:>12.1f} {levels[9]:>9.1f} {levels[6]:>9.1f} {levels[1]:>9.1f} "
+              f"{memo:>8.2f} {lengths:>18}")
+
+
+if __name__ == '__main__':
+    main()
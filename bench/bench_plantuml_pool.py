@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-render latency of render_plantuml with a fresh connection per
+request versus the shared keep-alive pool, against plantuml_stub_server.
+
+Usage:
+    python bench/bench_plantuml_pool.py [--renders 500] [--latency 0.005]
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mcp_diagram_server as server  # noqa: E402
+from plantuml_stub_server import PlantUMLStubServer  # noqa: E402
+
+
+def bench(label, renders, texts):
+    start = time.perf_counter()
+    for i in range(renders):
+        server.render_plantuml(texts[i % len(texts)])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {renders / elapsed:9.0f} renders/s  {elapsed / renders * 1e6:8.1f} us/render")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--renders', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stand-in adds to every render')
+    args = parser.parse_args()
+
+    httpd = PlantUMLStubServer(latency=args.latency).start()
+    os.environ['PLANTUML_SERVER'] = httpd.url
+    texts = [f'@startuml\nAlice -> Bob: message {i}\n@enduml' for i in range(50)]
+
+    # a throwaway requests.Session per call is what requests.get() does
+    class FreshConnections:
+        def get(self, url, timeout=None):
+            return requests.get(url, timeout=timeout)
+
+        def close(self):
+            pass
+
+    server._plantuml_http = FreshConnections()
+    fresh = bench('fresh connection per render', args.renders, texts)
+    server.close_plantuml_http_client()
+    pooled = bench('pooled keep-alive client', args.renders, texts)
+    print(f"speedup: {fresh / pooled:.2f}x")
+    httpd.stop()
+
+
+if __name__ == '__main__':
+    main()
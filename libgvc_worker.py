@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Graphviz layout worker for the in-process libgvc backend.
+
+mcp_diagram_server runs this script as a long-lived child process so the
+Graphviz C libraries never share the server's address space: a layout that
+runs past its deadline is killed with the process, and a crash inside libgvc
+takes down only this worker. It deliberately imports nothing from the server.
+
+Requests and replies are pickled tuples framed by a 4-byte big-endian length:
+
+    request  (source: bytes, formats: list of str, engine: bytes)
+    reply    ('ready', version) once at startup, then per request
+             ('ok', {format: bytes}), ('error', message) for a diagram
+             Graphviz rejects, or ('fail', message) for anything else
+
+Usage (done by LibGVC):
+    python libgvc_worker.py <libgvc path> <libcgraph path>
+"""
+import ctypes
+import os
+import pickle
+import struct
+import sys
+from typing import Dict, List
+
+
+class GraphvizError(Exception):
+    """Graphviz rejected the graph; the same source fails again"""
+
+
+class GVCBindings:
+    """ctypes bindings for the parts of libgvc/libcgraph used to render a graph"""
+
+    def __init__(self, gvc_path: str, cgraph_path: str):
+        self._gvc_lib = gvc = ctypes.CDLL(gvc_path)
+        self._cgraph = cgraph = ctypes.CDLL(cgraph_path)
+        gvc.gvContext.restype = ctypes.c_void_p
+        gvc.gvcVersion.argtypes = [ctypes.c_void_p]
+        gvc.gvcVersion.restype = ctypes.c_char_p
+        gvc.gvLayout.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p]
+        gvc.gvFreeLayout.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        gvc.gvFreeRenderData.argtypes = [ctypes.c_void_p]
+        cgraph.agmemread.argtypes = [ctypes.c_char_p]
+        cgraph.agmemread.restype = ctypes.c_void_p
+        cgraph.agclose.argtypes = [ctypes.c_void_p]
+        cgraph.aglasterr.restype = ctypes.c_char_p
+        cgraph.agseterr.argtypes = [ctypes.c_int]
+        cgraph.agseterr(2)  # AGMAX: keep errors for aglasterr() instead of printing them
+        self._gvc = gvc.gvContext()
+        if not self._gvc:
+            raise OSError('gvContext() failed')
+        self.version = (gvc.gvcVersion(self._gvc) or b'unknown').decode()
+        # Graphviz 3.0 widened gvRenderData's length from unsigned int* to size_t*
+        self._length_type = ctypes.c_size_t if self._major_version() >= 3 else ctypes.c_uint
+        gvc.gvRenderData.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p,
+                                     ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(self._length_type)]
+
+    def _major_version(self) -> int:
+        try:
+            return int(self.version.split('.')[0])
+        except ValueError:
+            raise OSError(f'cannot tell the gvRenderData ABI of libgvc {self.version}')
+
+    def _last_error(self) -> str:
+        return (self._cgraph.aglasterr() or b'').decode('utf-8', 'replace').strip()
+
+    def render(self, src: bytes, formats: List[str], engine: bytes) -> Dict[str, bytes]:
+        gvc = self._gvc_lib
+        graph = self._cgraph.agmemread(src)
+        if not graph:
+            raise GraphvizError(f'dot failed: {self._last_error() or "syntax error"}')
+        try:
+            if gvc.gvLayout(self._gvc, graph, engine) != 0:
+                raise GraphvizError(f'dot failed: {self._last_error() or "layout failed"}')
+            try:
+                return {fmt: self._render_data(graph, fmt) for fmt in formats}
+            finally:
+                gvc.gvFreeLayout(self._gvc, graph)
+        finally:
+            self._cgraph.agclose(graph)
+
+    def _render_data(self, graph, format: str) -> bytes:
+        gvc = self._gvc_lib
+        data = ctypes.c_void_p()
+        length = self._length_type(0)
+        if gvc.gvRenderData(self._gvc, graph, format.encode('ascii'), ctypes.byref(data), ctypes.byref(length)) != 0:
+            raise GraphvizError(f'dot failed: {self._last_error() or "cannot render " + format}')
+        try:
+            return ctypes.string_at(data, length.value)
+        finally:
+            gvc.gvFreeRenderData(data)
+
+
+def read_message(fd: int):
+    """Read one framed message, or None at end of stream"""
+    header = _read_exactly(fd, 4)
+    if header is None:
+        return None
+    body = _read_exactly(fd, struct.unpack('>I', header)[0])
+    if body is None:
+        return None
+    return pickle.loads(body)
+
+
+def _read_exactly(fd: int, size: int):
+    buf = b''
+    while len(buf) < size:
+        chunk = os.read(fd, size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def frame(message) -> bytes:
+    body = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return struct.pack('>I', len(body)) + body
+
+
+def write_message(fd: int, message) -> None:
+    data = frame(message)
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def main(gvc_path: str, cgraph_path: str) -> None:
+    # keep the protocol on a private descriptor so stray writes to stdout from
+    # the C libraries cannot corrupt it
+    out = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        lib = GVCBindings(gvc_path, cgraph_path)
+    except (OSError, AttributeError) as e:
+        write_message(out, ('fail', str(e)))
+        return
+    write_message(out, ('ready', lib.version))
+    while True:
+        request = read_message(0)
+        if request is None:
+            return
+        try:
+            reply = ('ok', lib.render(*request))
+        except GraphvizError as e:
+            reply = ('error', str(e))
+        except Exception as e:
+            reply = ('fail', f'{type(e).__name__}: {e}')
+        write_message(out, reply)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2])
@@ -16,6 +16,10 @@ API:
 HTTP mode:
 - POST /list_tools -> returns available tools and their schemas
 - POST /call_tool -> { "name": "tool_name", "arguments": { ... } }
+- GET /render/{engine}/{format}/{encoded} -> raw image, cacheable (ETag, immutable)
+- GET /ready -> readiness probe, 503 while the startup cache warm-up runs
+- POST /cache_stats -> hit/miss ratios, entries and bytes per engine, hottest keys
+- POST /cache_purge -> { "engine": ..., "key": ... } drop cached renders
 
 MCP SSE mode:
 - GET /sse -> Server-Sent Events endpoint for MCP protocol
@@ -27,23 +31,68 @@ MCP stdio mode:
 
 """
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, Response
 from pydantic import BaseModel
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 import base64
+import ctypes
+import ctypes.util
+import functools
+import hashlib
 import json
+import pickle
+import re
+import sqlite3
+import threading
+import time
 import zlib
 import requests
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+from requests.adapters import HTTPAdapter
+import select
+import shlex
+import signal
 import subprocess
 import shutil
 import tempfile
 import os
 import sys
 from dotenv import load_dotenv
+import libgvc_worker
+
+try:
+    import httpx  # optional, only used for PLANTUML_HTTP2
+except ImportError:
+    httpx = None
 
 load_dotenv()
 
-app = FastAPI(title="MCP Diagram Server")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    graphviz_backend()
+    graphviz_inprocess()
+    start_cache_warmup()
+    yield
+    close_plantuml_http_client()
+    if _plantuml_balancer is not None:
+        _plantuml_balancer.close()
+    if _plantuml_jvm_pool is not None:
+        _plantuml_jvm_pool.close()
+    lib = graphviz_inprocess()
+    if lib is not None:
+        lib.close()
+
+
+app = FastAPI(title="MCP Diagram Server", lifespan=lifespan)
 
 # -------------------- Web UI Endpoint --------------------
 
@@ -57,75 +106,1270 @@ async def root():
 # Implementation adapted from PlantUML specs.
 
 _ENCODE_TABLE = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+_BASE64_TABLE = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+# PlantUML's encoding is standard base64 (same big-endian 6-bit groups) with a
+# different alphabet and no padding, so the C base64 codec does the bit work
+# and bytes.translate swaps the alphabet.
+_TO_PLANTUML = bytes.maketrans(_BASE64_TABLE.encode('ascii'), _ENCODE_TABLE.encode('ascii'))
+_FROM_PLANTUML = bytes.maketrans(_ENCODE_TABLE.encode('ascii'), _BASE64_TABLE.encode('ascii'))
+
+# Upper bound on decoded diagram sources, guarding against deflate bombs
+MAX_SOURCE_BYTES = 1024 * 1024
+
 
 def _plantuml_encode(data: bytes) -> str:
-    # custom base64 using 6-bit groups
-    res = []
-    bit_buf = 0
-    bit_len = 0
-    for b in data:
-        bit_buf = (bit_buf << 8) | b
-        bit_len += 8
-        while bit_len >= 6:
-            bit_len -= 6
-            idx = (bit_buf >> bit_len) & 0x3F
-            res.append(_ENCODE_TABLE[idx])
-    if bit_len > 0:
-        idx = (bit_buf << (6 - bit_len)) & 0x3F
-        res.append(_ENCODE_TABLE[idx])
-    return ''.join(res)
-
-
-def plantuml_text_to_server_key(text: str) -> str:
-    # deflate (zlib) but strip zlib header as PlantUML uses raw deflate
-    compressed = zlib.compress(text.encode('utf-8'))
-    # strip zlib header (first 2 bytes) and checksum (last 4 bytes)
-    # alternative approach: use zlib.compressobj with -15 window to get raw deflate
-    comp = zlib.compressobj(level=9, wbits=-15)
+    return base64.b64encode(data).translate(_TO_PLANTUML).rstrip(b'=').decode('ascii')
+
+
+def _plantuml_decode(text: str) -> bytes:
+    # inverse of _plantuml_encode; trailing bits that do not fill a byte are padding
+    raw = text.encode('ascii', 'replace')
+    if raw.translate(None, _ENCODE_TABLE.encode('ascii')):
+        raise ValueError('invalid character in encoded diagram')
+    if len(raw) % 4 == 1:
+        # a lone trailing character carries only padding bits
+        raw = raw[:-1]
+    std = raw.translate(_FROM_PLANTUML)
+    return base64.b64decode(std + b'=' * (-len(std) % 4))
+
+
+def plantuml_server_key_to_text(key: str) -> str:
+    """Decode a key produced by plantuml_text_to_server_key back to diagram text"""
+    inflater = zlib.decompressobj(wbits=-15)
+    raw = inflater.decompress(_plantuml_decode(key), MAX_SOURCE_BYTES)
+    if inflater.unconsumed_tail:
+        raise ValueError('decoded diagram exceeds size limit')
+    if not inflater.eof:
+        # a truncated key inflates to a prefix of the source
+        raise ValueError('encoded diagram is truncated')
+    return raw.decode('utf-8')
+
+
+# Lower levels trade slightly longer URLs for less CPU on large diagrams
+PLANTUML_DEFLATE_LEVEL = int(os.environ.get('PLANTUML_DEFLATE_LEVEL', 9))
+PLANTUML_KEY_CACHE_SIZE = int(os.environ.get('PLANTUML_KEY_CACHE_SIZE', 256))
+# Longer sources are encoded every time, bounding the memo to SIZE x MAX_CHARS
+PLANTUML_KEY_CACHE_MAX_CHARS = int(os.environ.get('PLANTUML_KEY_CACHE_MAX_CHARS', 8192))
+
+
+@functools.lru_cache(maxsize=PLANTUML_KEY_CACHE_SIZE)
+def _server_key(text: str, level: int) -> str:
+    # PlantUML uses raw deflate: a negative window size omits the zlib header and checksum
+    comp = zlib.compressobj(level=level, wbits=-15)
     raw = comp.compress(text.encode('utf-8')) + comp.flush()
     return _plantuml_encode(raw)
 
+
+def plantuml_text_to_server_key(text: str, level: Optional[int] = None) -> str:
+    """Encode diagram text as a PlantUML server key; recently seen small sources are memoized"""
+    level = PLANTUML_DEFLATE_LEVEL if level is None else level
+    if len(text) > PLANTUML_KEY_CACHE_MAX_CHARS:
+        return _server_key.__wrapped__(text, level)
+    return _server_key(text, level)
+
+# -------------------- PlantUML HTTP client --------------------
+# One keep-alive connection pool shared by every render (and every thread the
+# async handlers offload renders to), instead of a TCP/TLS handshake per call.
+
+PLANTUML_POOL_SIZE = int(os.environ.get('PLANTUML_POOL_SIZE', 10))
+# Sources or encoded keys longer than this are POSTed instead of sent in the URL; common
+# proxy and servlet limits start around 4-8 KB for the whole request line.
+PLANTUML_POST_THRESHOLD = int(os.environ.get('PLANTUML_POST_THRESHOLD', 4000))
+
+_plantuml_http = None
+_plantuml_http_lock = threading.Lock()
+
+
+def _new_plantuml_http_client():
+    if os.environ.get('PLANTUML_HTTP2', '0') == '1':
+        if httpx is not None:
+            try:
+                limits = httpx.Limits(max_connections=PLANTUML_POOL_SIZE,
+                                      max_keepalive_connections=PLANTUML_POOL_SIZE)
+                return httpx.Client(http2=True, limits=limits)
+            except ImportError:
+                pass  # httpx installed without the h2 extra
+        print("PLANTUML_HTTP2 requires httpx[http2]; falling back to HTTP/1.1", file=sys.stderr)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=PLANTUML_POOL_SIZE, pool_maxsize=PLANTUML_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def plantuml_http_client():
+    """Shared pooled HTTP client for the PlantUML server, created on first use"""
+    global _plantuml_http
+    if _plantuml_http is None:
+        with _plantuml_http_lock:
+            if _plantuml_http is None:
+                _plantuml_http = _new_plantuml_http_client()
+    return _plantuml_http
+
+
+def close_plantuml_http_client() -> None:
+    global _plantuml_http
+    with _plantuml_http_lock:
+        if _plantuml_http is not None:
+            _plantuml_http.close()
+            _plantuml_http = None
+
+
+# -------------------- Local PlantUML (persistent JVM pool) --------------------
+# With PLANTUML_JAR set, diagrams are rendered by long-lived
+# `java -jar plantuml.jar -pipe` processes instead of the remote server. Each
+# worker handles one output format and streams diagrams separated by a
+# delimiter, so the multi-second JVM startup is paid once per worker.
+
+PLANTUML_JAR = os.environ.get('PLANTUML_JAR')
+PLANTUML_JAVA = os.environ.get('PLANTUML_JAVA', 'java')
+PLANTUML_JVM_POOL_SIZE = int(os.environ.get('PLANTUML_JVM_POOL_SIZE', 2))
+PLANTUML_JVM_MAX_RENDERS = int(os.environ.get('PLANTUML_JVM_MAX_RENDERS', 500))
+# Cap on workers across every format and page slot; idle workers of other
+# slots are stopped to make room
+PLANTUML_JVM_MAX_WORKERS = int(os.environ.get('PLANTUML_JVM_MAX_WORKERS', 4))
+PLANTUML_REMOTE_FALLBACK = os.environ.get('PLANTUML_REMOTE_FALLBACK', '1') != '0'
+
+_PIPE_DELIMITER = b'___MCP_DIAGRAM_SERVER_END___'
+# With -pipeNoStderr a failed diagram's error image is followed on stdout by
+# "ERROR", the line number and the messages; these mark where images end.
+_PIPE_IMAGE_END = {'svg': b'</svg>', 'png': b'IEND\xaeB`\x82'}
+_HEALTH_CHECK_DIAGRAM = '@startuml\nA -> B\n@enduml'
+
+
+def _health_check_diagram(page: int) -> str:
+    # a page worker needs a diagram that actually has that page
+    if not page:
+        return _HEALTH_CHECK_DIAGRAM
+    return '@startuml\n' + 'A -> B\nnewpage\n' * page + 'A -> B\n@enduml'
+
+
+def plantuml_worker_slot(format: str, page: int = 0) -> str:
+    """Pool key for workers of one output format and page index"""
+    return f'{format}#{page}' if page else format
+
+
+class PlantUMLWorker:
+    """One ``plantuml.jar -pipe`` process rendering a single output format and page"""
+
+    def __init__(self, jar: str, format: str, java: str = 'java', startup_timeout: float = 60.0,
+                 page: int = 0):
+        self.format = format
+        self.page = page
+        self.slot = plantuml_worker_slot(format, page)
+        self.renders = 0
+        self.idle_since = time.monotonic()
+        cmd = shlex.split(java) + [
+            '-Djava.awt.headless=true', '-jar', jar, '-pipe', f'-t{format}',
+            '-charset', 'UTF-8', '-pipedelimitor', _PIPE_DELIMITER.decode('ascii'), '-pipeNoStderr',
+        ]
+        if page:
+            cmd += ['-pipeimageindex', str(page)]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, bufsize=0)
+        self._buf = b''
+        # first render doubles as a health check and warms up the JIT
+        try:
+            self.render(_health_check_diagram(page), timeout=startup_timeout)
+        except Exception:
+            self.close()
+            raise
+        self.renders = 0
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    @staticmethod
+    def _frame(text: str) -> bytes:
+        # -pipe answers every block it reads, so send exactly one; like the
+        # remote server, only the first block of a multi-diagram source renders
+        blocks = split_plantuml_blocks(text)
+        text = blocks[0] if blocks else f'@startuml\n{text}\n@enduml'
+        return text.encode('utf-8') + b'\n'
+
+    def _check(self, out: bytes) -> bytes:
+        """Raise RenderError when PlantUML reported an error after the image"""
+        marker = _PIPE_IMAGE_END.get(self.format)
+        end = out.rfind(marker) + len(marker) if marker and marker in out else 0
+        tail = out[end:].strip()
+        if not tail.startswith(b'ERROR'):
+            return out
+        lines = tail.decode('utf-8', 'replace').splitlines()[1:]
+        detail = f" at line {lines[0]}: {'; '.join(lines[1:])}" if lines else ''
+        raise RenderError(f'PlantUML syntax error{detail}')
+
+    def render(self, text: str, timeout: float = 20.0) -> bytes:
+        self.proc.stdin.write(self._frame(text))
+        self.proc.stdin.flush()
+        return self._check(self._read_output(time.monotonic() + timeout))
+
+    def render_many(self, texts: List[str], timeout: float = 20.0) -> List[Union[bytes, Exception]]:
+        """Pipe every diagram into this process at once and split the outputs back.
+
+        A diagram PlantUML rejects yields its RenderError in place of the image.
+        ``timeout`` covers the whole batch. Writing happens on a helper thread
+        so a large batch cannot deadlock against a full stdout pipe.
+        """
+        deadline = time.monotonic() + timeout
+        payload = b''.join(self._frame(text) for text in texts)
+        errors: List[BaseException] = []
+
+        def write() -> None:
+            try:
+                self.proc.stdin.write(payload)
+                self.proc.stdin.flush()
+            except BaseException as e:  # surfaced after the reads
+                errors.append(e)
+
+        writer = threading.Thread(target=write, name='plantuml-batch-writer', daemon=True)
+        writer.start()
+        try:
+            outputs = [self._read_output(deadline) for _ in texts]
+        finally:
+            writer.join(max(0.0, deadline - time.monotonic()))
+        if errors:
+            raise errors[0]
+        # every output has been read, so the worker stays in sync even if one failed
+        results: List[Union[bytes, Exception]] = []
+        for out in outputs:
+            try:
+                results.append(self._check(out))
+            except RenderError as e:
+                results.append(e)
+        return results
+
+    def _read_output(self, deadline: float) -> bytes:
+        fd = self.proc.stdout.fileno()
+        while True:
+            end = self._buf.find(_PIPE_DELIMITER)
+            if end >= 0:
+                out = self._buf[:end]
+                # the delimiter is written on its own line
+                self._buf = self._buf[end + len(_PIPE_DELIMITER):].lstrip(b'\r\n')
+                self.renders += 1
+                return out.rstrip(b'\r\n') if self.format == 'svg' else out
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RenderTimeout('local PlantUML render timed out')
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise RuntimeError('local PlantUML process exited')
+                self._buf += chunk
+
+    def close(self) -> None:
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class PlantUMLJVMPool:
+    """Pool of warm PlantUML workers per format and page, recycled after ``max_renders``.
+
+    At most ``size`` workers serve one slot and ``max_workers`` exist in total;
+    a slot that needs a worker beyond that stops the longest idle worker of
+    another slot.
+    """
+
+    def __init__(self, jar: str, size: int = 2, max_renders: int = 500, java: str = 'java',
+                 max_workers: int = 4):
+        self.jar = jar
+        self.java = java
+        self.size = max(1, size)
+        self.max_workers = max(1, max_workers)
+        self.max_renders = max_renders
+        self._idle: Dict[str, List[PlantUMLWorker]] = {}
+        self._count: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self.spawned = 0
+        self.recycled = 0
+        self.failures = 0
+        self.evicted = 0
+
+    def _evict_idle(self, slot: str) -> Optional[PlantUMLWorker]:
+        """Take the longest idle worker of another slot out of the pool (lock held)"""
+        candidates = [(idle[0].idle_since, other) for other, idle in self._idle.items() if other != slot and idle]
+        if not candidates:
+            return None
+        _, other = min(candidates)
+        victim = self._idle[other].pop(0)
+        self._count[other] -= 1
+        if not self._count[other]:
+            del self._count[other], self._idle[other]
+        self.evicted += 1
+        return victim
+
+    def _acquire(self, format: str, timeout: float, page: int = 0) -> PlantUMLWorker:
+        deadline = time.monotonic() + timeout
+        slot = plantuml_worker_slot(format, page)
+        victim = None
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(slot, [])
+                while idle:
+                    worker = idle.pop()
+                    if worker.alive():
+                        return worker
+                    self._count[slot] -= 1  # died while idle
+                if self._count.get(slot, 0) < self.size:
+                    if sum(self._count.values()) >= self.max_workers:
+                        victim = self._evict_idle(slot)
+                    if victim is not None or sum(self._count.values()) < self.max_workers:
+                        self._count[slot] = self._count.get(slot, 0) + 1
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RenderTimeout('no local PlantUML worker available')
+                self._cond.wait(remaining)
+        if victim is not None:
+            victim.close()
+        try:
+            worker = PlantUMLWorker(self.jar, format, java=self.java, page=page)
+        except Exception:
+            with self._cond:
+                self._count[slot] -= 1
+                self._cond.notify_all()
+            raise
+        self.spawned += 1
+        return worker
+
+    def _release(self, worker: PlantUMLWorker, healthy: bool) -> None:
+        recycle = not healthy or not worker.alive() or worker.renders >= self.max_renders
+        if recycle:
+            worker.close()
+        with self._cond:
+            if recycle:
+                self._count[worker.slot] -= 1
+                if healthy:
+                    self.recycled += 1
+                else:
+                    self.failures += 1
+            else:
+                worker.idle_since = time.monotonic()
+                self._idle[worker.slot].append(worker)
+            # waiters may be blocked on the slot or on the global cap
+            self._cond.notify_all()
+
+    def render(self, text: str, format: str = 'svg', timeout: float = 20.0, page: int = 0) -> bytes:
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(format, timeout, page)
+        healthy = False
+        try:
+            data = worker.render(text, timeout=deadline - time.monotonic())
+            healthy = True
+            return data
+        except RenderError:
+            healthy = True  # the worker answered; only the diagram was bad
+            raise
+        finally:
+            # a worker that timed out may still be writing; never reuse it
+            self._release(worker, healthy)
+
+    def render_many(self, texts: List[str], format: str = 'svg',
+                    timeout: float = 20.0) -> List[Union[bytes, Exception]]:
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(format, timeout)
+        healthy = False
+        try:
+            outputs = worker.render_many(texts, timeout=deadline - time.monotonic())
+            healthy = True
+            return outputs
+        finally:
+            self._release(worker, healthy)
+
+    def close(self) -> None:
+        with self._cond:
+            workers = [w for idle in self._idle.values() for w in idle]
+            self._idle.clear()
+            self._count.clear()
+        for worker in workers:
+            worker.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'jar': self.jar,
+                'size': self.size,
+                'max_workers': self.max_workers,
+                'workers': dict(self._count),
+                'idle': {fmt: len(idle) for fmt, idle in self._idle.items()},
+                'spawned': self.spawned,
+                'recycled': self.recycled,
+                'failures': self.failures,
+                'evicted': self.evicted,
+            }
+
+
+_plantuml_jvm_pool: Optional[PlantUMLJVMPool] = None
+_plantuml_jvm_lock = threading.Lock()
+
+
+def plantuml_jvm_pool() -> Optional[PlantUMLJVMPool]:
+    """The local PlantUML pool, or None when PLANTUML_JAR is not configured"""
+    global _plantuml_jvm_pool
+    if _plantuml_jvm_pool is None and PLANTUML_JAR:
+        with _plantuml_jvm_lock:
+            if _plantuml_jvm_pool is None:
+                _plantuml_jvm_pool = PlantUMLJVMPool(PLANTUML_JAR, PLANTUML_JVM_POOL_SIZE,
+                                                     PLANTUML_JVM_MAX_RENDERS, PLANTUML_JAVA,
+                                                     PLANTUML_JVM_MAX_WORKERS)
+    return _plantuml_jvm_pool
+
+
+# -------------------- PlantUML server balancing --------------------
+# PLANTUML_SERVERS lists several PlantUML servers. Each request goes to the
+# healthy backend with the fewest outstanding requests; backends that fail or
+# answer slower than PLANTUML_SLOW_SECONDS repeatedly are ejected for a while
+# (circuit breaker), optionally probed in the background, and slow requests
+# can be hedged on a second backend.
+
+DEFAULT_PLANTUML_SERVER = 'https://www.plantuml.com/plantuml'
+PLANTUML_FAILURE_THRESHOLD = int(os.environ.get('PLANTUML_FAILURE_THRESHOLD', 3))
+PLANTUML_EJECT_SECONDS = float(os.environ.get('PLANTUML_EJECT_SECONDS', 30))
+PLANTUML_SLOW_SECONDS = float(os.environ.get('PLANTUML_SLOW_SECONDS', 10))
+PLANTUML_HEALTH_INTERVAL = float(os.environ.get('PLANTUML_HEALTH_INTERVAL', 0))
+PLANTUML_HEDGE_PERCENTILE = float(os.environ.get('PLANTUML_HEDGE_PERCENTILE', 0))
+
+# latency samples needed before hedging kicks in
+_HEDGE_MIN_SAMPLES = 20
+
+
+def plantuml_server_urls() -> List[str]:
+    servers = os.environ.get('PLANTUML_SERVERS') or os.environ.get('PLANTUML_SERVER', DEFAULT_PLANTUML_SERVER)
+    return [u.strip().rstrip('/') for u in servers.split(',') if u.strip()]
+
+
+class PlantUMLBackend:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.latencies: deque = deque(maxlen=200)
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'ejected': self.ejected_until > time.monotonic(),
+        }
+
+
+class PlantUMLBalancer:
+    """Least-outstanding-requests balancing with circuit breaking and hedging"""
+
+    def __init__(self, urls: List[str], failure_threshold: int = 3, eject_seconds: float = 30,
+                 slow_seconds: float = 10, hedge_percentile: float = 0, health_interval: float = 0):
+        self.backends = [PlantUMLBackend(u) for u in urls]
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.slow_seconds = slow_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if hedge_percentile > 0 and len(self.backends) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=PLANTUML_POOL_SIZE * 2,
+                                                thread_name_prefix='plantuml-hedge')
+        if health_interval > 0:
+            threading.Thread(target=self._health_loop, args=(health_interval,),
+                             name='plantuml-health', daemon=True).start()
+
+    def _pick(self, exclude=()) -> PlantUMLBackend:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+            if not candidates:
+                # everything is ejected: fail open on the backend closest to recovery
+                candidates = sorted((b for b in self.backends if b not in exclude),
+                                    key=lambda b: b.ejected_until)[:1]
+            if not candidates:
+                raise RuntimeError('no PlantUML backend available')
+            backend = min(candidates, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            return backend
+
+    def _record(self, backend: PlantUMLBackend, latency: float, ok: bool) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            backend.latencies.append(latency)
+            if ok and latency <= self.slow_seconds:
+                backend.consecutive_failures = 0
+                return
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.failure_threshold:
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    def _call(self, backend: PlantUMLBackend, fn: Callable[[str], Any]):
+        start = time.monotonic()
+        try:
+            result = fn(backend.url)
+        except Exception as e:
+            # the diagram itself is bad: not the backend's fault
+            self._record(backend, time.monotonic() - start, is_deterministic_failure(e))
+            raise
+        self._record(backend, time.monotonic() - start, True)
+        return result
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency percentile after which a second backend is tried, if hedging is on"""
+        if self._executor is None:
+            return None
+        with self._lock:
+            samples = sorted(x for b in self.backends for x in b.latencies)
+        if len(samples) < _HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))]
+
+    def request(self, fn: Callable[[str], Any]):
+        """Call ``fn(base_url)`` on the best backend, retrying once elsewhere on transient errors"""
+        primary = self._pick()
+        delay = self.hedge_delay()
+        if delay is not None:
+            return self._hedged(primary, fn, delay)
+        try:
+            return self._call(primary, fn)
+        except Exception as e:
+            # a timed-out render has no time left to retry elsewhere
+            if is_deterministic_failure(e) or isinstance(e, RenderTimeout) or len(self.backends) < 2:
+                raise
+        return self._call(self._pick(exclude=(primary,)), fn)
+
+    def _hedged(self, primary: PlantUMLBackend, fn: Callable[[str], Any], delay: float):
+        first = self._executor.submit(self._call, primary, fn)
+        done, _ = wait([first], timeout=delay)
+        if done and first.exception() is None:
+            return first.result()
+        if done and is_deterministic_failure(first.exception()):
+            raise first.exception()
+        self.hedges += 1
+        futures = [first, self._executor.submit(self._call, self._pick(exclude=(primary,)), fn)]
+        error = None
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for f in done:
+                futures.remove(f)
+                if f.exception() is None:
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def _health_loop(self, interval: float) -> None:
+        key = plantuml_text_to_server_key(_HEALTH_CHECK_DIAGRAM)
+        while not self._closed.wait(interval):
+            for backend in self.backends:
+                try:
+                    resp = plantuml_http_client().get(f'{backend.url}/svg/{key}', timeout=5)
+                    healthy = resp.status_code < 500
+                except Exception:
+                    healthy = False
+                with self._lock:
+                    if healthy:
+                        backend.consecutive_failures = 0
+                        backend.ejected_until = 0.0
+                    else:
+                        backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'backends': [b.stats() for b in self.backends], 'hedges': self.hedges}
+
+
+_plantuml_balancer: Optional[PlantUMLBalancer] = None
+_plantuml_balancer_lock = threading.Lock()
+
+
+def plantuml_balancer() -> PlantUMLBalancer:
+    """Balancer over the configured PlantUML servers, rebuilt when the list changes"""
+    global _plantuml_balancer
+    urls = plantuml_server_urls()
+    with _plantuml_balancer_lock:
+        if _plantuml_balancer is None or [b.url for b in _plantuml_balancer.backends] != urls:
+            if _plantuml_balancer is not None:
+                _plantuml_balancer.close()
+            _plantuml_balancer = PlantUMLBalancer(
+                urls, PLANTUML_FAILURE_THRESHOLD, PLANTUML_EJECT_SECONDS, PLANTUML_SLOW_SECONDS,
+                PLANTUML_HEDGE_PERCENTILE, PLANTUML_HEALTH_INTERVAL,
+            )
+        return _plantuml_balancer
+
+
 # -------------------- Rendering backends --------------------
 
-def render_plantuml(text: str, format: str = "svg") -> bytes:
-    """Render using public PlantUML server as fallback.
+class RenderError(RuntimeError):
+    """The renderer rejected the diagram source; the same source fails again on retry"""
+
+
+class RenderTimeout(TimeoutError):
+    """The render did not finish before its deadline; never cached as a failure"""
+
+
+class InvalidArguments(ValueError):
+    """A tool argument the client has to fix: HTTP 400 or JSON-RPC -32602"""
+
+
+# Output formats each engine can produce, with their media types
+RENDER_FORMATS = {
+    'plantuml': {'svg': 'image/svg+xml', 'png': 'image/png'},
+    'graphviz': {'svg': 'image/svg+xml', 'png': 'image/png', 'pdf': 'application/pdf',
+                 'dot': 'text/vnd.graphviz'},
+    'mermaid': {'svg': 'image/svg+xml', 'png': 'image/png', 'pdf': 'application/pdf'},
+}
+
+
+def media_type(engine: str, format: str) -> str:
+    """Media type of ``format`` for ``engine``; unsupported formats are rejected"""
+    try:
+        return RENDER_FORMATS[engine][format]
+    except (KeyError, TypeError):
+        raise InvalidArguments(f"unsupported {engine} format: {format} "
+                               f"(expected one of {', '.join(RENDER_FORMATS[engine])})") from None
+
+
+# Default per-engine deadlines in seconds; a tools/call ``timeout`` may lower
+# or raise them, up to RENDER_TIMEOUT_MAX.
+RENDER_TIMEOUTS = {
+    'plantuml': float(os.environ.get('RENDER_TIMEOUT_PLANTUML', 20)),
+    'graphviz': float(os.environ.get('RENDER_TIMEOUT_GRAPHVIZ', 30)),
+    'mermaid': float(os.environ.get('RENDER_TIMEOUT_MERMAID', 60)),
+}
+RENDER_TIMEOUT_MAX = float(os.environ.get('RENDER_TIMEOUT_MAX', 120))
+
+
+def render_timeout(engine: str, requested=None) -> float:
+    """Resolve the deadline for one render: the requested seconds or the engine default"""
+    if requested is None:
+        return RENDER_TIMEOUTS[engine]
+    try:
+        timeout = float(requested)
+    except (TypeError, ValueError):
+        timeout = 0.0
+    if not timeout > 0:  # also rejects NaN
+        raise InvalidArguments(f'timeout must be a positive number of seconds, not {requested!r}')
+    return min(timeout, RENDER_TIMEOUT_MAX)
+
+
+def time_left(deadline: float) -> float:
+    """Seconds until ``deadline`` (a time.monotonic() value), raising once it has passed"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise RenderTimeout('render deadline exceeded')
+    return remaining
+
+
+def _run_renderer(cmd: List[str], name: str, timeout: float, input: Optional[bytes] = None,
+                  on_start: Optional[Callable[[int], None]] = None):
+    """Run a renderer subprocess, killing it and its children when ``timeout`` expires.
+
+    on_start: called with the pid before any input is written, e.g. to set limits
+    """
+    # own session so npx/mmdc and the browser they launch die together
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        if on_start is not None:
+            on_start(p.pid)
+    except BaseException:
+        os.killpg(p.pid, signal.SIGKILL)
+        p.communicate()
+        raise
+    try:
+        out, err = p.communicate(input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        p.communicate()
+        raise RenderTimeout(f'{name} timed out after {timeout:g}s')
+    return p.returncode, out, err
+
+
+def render_plantuml(text: str, format: str = "svg", page: int = 0, timeout: Optional[float] = None) -> bytes:
+    """Render using the local JVM pool when PLANTUML_JAR is set, else the PlantUML server.
     format: 'svg' or 'png'
+    page: zero-based page of a diagram split with ``newpage``
+    timeout: seconds before the render is abandoned (default RENDER_TIMEOUT_PLANTUML)
     Returns raw bytes of image/svg+xml or PNG.
     """
+    deadline = time.monotonic() + (timeout or RENDER_TIMEOUTS['plantuml'])
+    pool = plantuml_jvm_pool()
+    if pool is not None and page and PLANTUML_REMOTE_FALLBACK and count_plantuml_pages(text) > pool.max_workers:
+        # every page index needs its own JVM; with more pages than the pool keeps
+        # warm, each page would start one, so the server renders them instead
+        # (page 0 stays local: it shares its cache entry with the unsplit render)
+        pool = None
+    if pool is not None:
+        try:
+            return pool.render(text, format, timeout=time_left(deadline), page=page)
+        except (RenderTimeout, RenderError):
+            raise
+        except Exception as e:
+            if not PLANTUML_REMOTE_FALLBACK:
+                raise
+            print(f"Local PlantUML failed, falling back to server: {e}", file=sys.stderr)
+    return _render_plantuml_remote(text, format, page, deadline)
+
+
+def render_plantuml_batch(texts: List[str], format: str = "svg",
+                          timeout: Optional[float] = None) -> List[Union[bytes, Exception]]:
+    """Render several PlantUML diagrams, returning one result per text in order.
+
+    A diagram that fails yields its exception in place of the image, so one
+    bad diagram does not lose the others. With PLANTUML_JAR set the whole
+    batch goes through a single warm JVM; otherwise the diagrams share the
+    pooled keep-alive connections. ``timeout`` bounds the whole batch.
+    """
+    if not texts:
+        return []
+    deadline = time.monotonic() + (timeout or RENDER_TIMEOUTS['plantuml'])
+    pool = plantuml_jvm_pool()
+    if pool is not None:
+        try:
+            return pool.render_many(texts, format, timeout=time_left(deadline))
+        except RenderTimeout:
+            raise
+        except Exception as e:
+            if not PLANTUML_REMOTE_FALLBACK:
+                raise
+            print(f"Local PlantUML batch failed, falling back to server: {e}", file=sys.stderr)
+
+    def render_one(text: str) -> Union[bytes, Exception]:
+        try:
+            return _render_plantuml_remote(text, format, 0, deadline)
+        except Exception as e:
+            return e
+
+    if len(texts) == 1:
+        return [render_one(texts[0])]
+    with ThreadPoolExecutor(max_workers=min(len(texts), PLANTUML_POOL_SIZE),
+                            thread_name_prefix='plantuml-batch') as executor:
+        return list(executor.map(render_one, texts))
+
+
+def _plantuml_get_key(text: str) -> Optional[str]:
+    """Server key for a GET request, or None when the diagram must be POSTed.
+
+    Deflate rarely shrinks a source by more than a few times, so sources already
+    longer than PLANTUML_POST_THRESHOLD skip the encoding entirely.
+    """
+    if len(text.encode('utf-8')) > PLANTUML_POST_THRESHOLD:
+        return None
     key = plantuml_text_to_server_key(text)
-    server = os.environ.get('PLANTUML_SERVER', 'https://www.plantuml.com/plantuml')
-    url = f"{server}/{format}/{key}"
-    resp = requests.get(url, timeout=20)
+    return key if len(key) <= PLANTUML_POST_THRESHOLD else None
+
+
+def _render_plantuml_remote(text: str, format: str, page: int, deadline: float) -> bytes:
+    key = _plantuml_get_key(text)
+    return plantuml_balancer().request(
+        lambda server: _fetch_plantuml(server, text, key, format, page, time_left(deadline)))
+
+
+_PLANTUML_BLOCK = re.compile(r'^[ \t]*@start(\w+)\b.*?^[ \t]*@end\1\b[^\n]*', re.MULTILINE | re.DOTALL)
+
+
+def split_plantuml_blocks(text: str) -> List[str]:
+    """Return every ``@startxxx ... @endxxx`` block in ``text``, in order"""
+    return [m.group(0).strip() for m in _PLANTUML_BLOCK.finditer(text)]
+
+
+_PLANTUML_NEWPAGE = re.compile(r'^[ \t]*newpage\b', re.MULTILINE)
+
+
+def count_plantuml_pages(text: str) -> int:
+    """Number of pages PlantUML produces for the (first) diagram in ``text``"""
+    blocks = split_plantuml_blocks(text)
+    return len(_PLANTUML_NEWPAGE.findall(blocks[0] if blocks else text)) + 1
+
+
+def _fetch_plantuml(server: str, text: str, key: Optional[str], format: str, page: int = 0,
+                    timeout: float = 20) -> bytes:
+    try:
+        return _fetch_plantuml_once(server, text, key, format, page, timeout)
+    except HTTP_TIMEOUT_ERRORS as e:
+        raise RenderTimeout(f'PlantUML server {server} timed out after {timeout:g}s') from e
+
+
+def _fetch_plantuml_once(server: str, text: str, key: Optional[str], format: str, page: int,
+                         timeout: float) -> bytes:
+    client = plantuml_http_client()
+    # the server renders page N of a diagram at /{format}/{N}/{key}
+    endpoint = f"{server}/{format}/{page}" if page else f"{server}/{format}"
+    if key is None:
+        # too long for a URL: send the plain source to the server's POST endpoint
+        body = text.encode('utf-8')
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if httpx is not None and isinstance(client, httpx.Client):
+            resp = client.post(endpoint, content=body, headers=headers, timeout=timeout)
+        else:
+            resp = client.post(endpoint, data=body, headers=headers, timeout=timeout)
+    else:
+        resp = client.get(f"{endpoint}/{key}", timeout=timeout)
     resp.raise_for_status()
     return resp.content
 
 
-def render_graphviz(dot_src: str, format: str = 'png') -> bytes:
-    """Render Graphviz using graphviz package or dot binary.
-    format: 'png' or 'svg'.
+class GraphvizBackend(NamedTuple):
+    kind: str  # 'dot' or 'unavailable'
+    path: Optional[str]
+    version: str
+
+
+@functools.lru_cache(maxsize=None)
+def graphviz_backend() -> GraphvizBackend:
+    """Find the dot binary once per process.
+
+    GRAPHVIZ_DOT overrides the dot binary looked up on PATH. Without dot,
+    Graphviz is unavailable: python-graphviz only shells out to the same binary.
+    """
+    dot_bin = shutil.which(os.environ.get('GRAPHVIZ_DOT') or 'dot')
+    if dot_bin:
+        return GraphvizBackend('dot', dot_bin, _tool_version(dot_bin, '-V'))
+    return GraphvizBackend('unavailable', None, 'unavailable')
+
+
+# GRAPHVIZ_BACKEND=libgvc renders small graphs in-process through libgvc;
+# anything larger still goes to a dot process, which can be killed at its deadline.
+GRAPHVIZ_BACKEND = os.environ.get('GRAPHVIZ_BACKEND', 'auto').lower()
+GRAPHVIZ_INPROCESS_MAX_BYTES = int(os.environ.get('GRAPHVIZ_INPROCESS_MAX_BYTES', 16384))
+
+
+class LibGVCCrashed(RuntimeError):
+    """The libgvc worker process died; the render can still be retried with dot"""
+
+
+LIBGVC_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libgvc_worker.py')
+
+
+class LibGVCBusy(RuntimeError):
+    """Every libgvc worker is rendering; the graph can go to dot instead"""
+
+
+class _LibGVCWorker:
+    """One libgvc_worker.py process, rendering one request at a time"""
+
+    def __init__(self, cmd: List[str], deadline: float):
+        self._proc: Optional[subprocess.Popen] = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            start_new_session=True)
+        self._buf = b''
+        try:
+            # the worker outlives single renders, so it gets no cumulative CPU limit;
+            # the deadline bounds each layout instead
+            apply_graphviz_rlimits(self._proc.pid, cpu=False)
+        except OSError:
+            self.kill()
+            raise
+        status, value = self._read_reply(deadline)
+        if status != 'ready':
+            self.kill()
+            raise OSError(value)
+        self.version: str = value
+
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def kill(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdin.close()
+            proc.stdout.close()
+
+    def request(self, request, deadline: float):
+        try:
+            self._proc.stdin.write(libgvc_worker.frame(request))
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            self.kill()
+            raise LibGVCCrashed('libgvc worker exited')
+        return self._read_reply(deadline)
+
+    def _read_reply(self, deadline: float):
+        fd = self._proc.stdout.fileno()
+        while True:
+            if len(self._buf) >= 4:
+                size = int.from_bytes(self._buf[:4], 'big')
+                if len(self._buf) >= 4 + size:
+                    body, self._buf = self._buf[4:4 + size], self._buf[4 + size:]
+                    return pickle.loads(body)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # a running layout cannot be interrupted; only the process can go
+                self.kill()
+                raise RenderTimeout('libgvc render timed out')
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    code = self._proc.wait()
+                    self.kill()
+                    raise LibGVCCrashed(f'libgvc worker exited with code {code}')
+                self._buf += chunk
+
+
+class LibGVC:
+    """Graphviz layout and rendering through libgvc/libcgraph, loaded via ctypes.
+
+    The libraries run in long-lived worker processes (libgvc_worker.py)
+    rather than in the server: a layout past its deadline is stopped by killing
+    its worker, and a crash in libgvc only loses that worker. libgvc is not
+    thread-safe, so each worker renders one graph at a time; up to
+    ``max_workers`` are started as renders overlap. When all of them are busy
+    render_many raises LibGVCBusy at once rather than queueing behind a slow
+    layout.
     """
+
+    def __init__(self, gvc_path: Optional[str] = None, cgraph_path: Optional[str] = None,
+                 startup_timeout: float = 30.0, max_workers: int = 1):
+        gvc_path = gvc_path or ctypes.util.find_library('gvc')
+        cgraph_path = cgraph_path or ctypes.util.find_library('cgraph')
+        if not gvc_path or not cgraph_path:
+            raise OSError('libgvc/libcgraph not found')
+        self.path = gvc_path
+        self.max_workers = max(1, max_workers)
+        self._cmd = [sys.executable, LIBGVC_WORKER, gvc_path, cgraph_path]
+        self._lock = threading.Lock()
+        self._idle: List[_LibGVCWorker] = []
+        self._count = 0
+        self._closed = False
+        self.restarts = 0
+        self.busy = 0
+        try:
+            worker = _LibGVCWorker(self._cmd, time.monotonic() + startup_timeout)
+        except (RenderTimeout, LibGVCCrashed) as e:
+            raise OSError(f'libgvc worker did not start: {e}')
+        self.version = worker.version
+        self._idle.append(worker)
+        self._count = 1
+
+    def _acquire(self, deadline: float) -> _LibGVCWorker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.kill()  # died while idle
+                self._count -= 1
+                self.restarts += 1
+            if self._count >= self.max_workers:
+                self.busy += 1
+                raise LibGVCBusy(f'all {self.max_workers} libgvc workers are busy')
+            self._count += 1
+        try:
+            return _LibGVCWorker(self._cmd, deadline)
+        except BaseException as e:
+            with self._lock:
+                self._count -= 1
+            if isinstance(e, (OSError, ValueError)):
+                raise LibGVCCrashed(f'libgvc worker did not start: {e}')
+            raise
+
+    def _release(self, worker: _LibGVCWorker, healthy: bool) -> None:
+        with self._lock:
+            if healthy and worker.alive() and not self._closed:
+                self._idle.append(worker)
+                return
+            self._count -= 1
+            if not healthy:
+                self.restarts += 1
+        worker.kill()
+
+    def render(self, dot_src: str, format: str = 'png', timeout: Optional[float] = None) -> bytes:
+        return self.render_many(dot_src, [format], timeout)[format]
+
+    def render_many(self, dot_src: str, formats: List[str], timeout: Optional[float] = None,
+                    engine: str = 'dot') -> Dict[str, bytes]:
+        """Lay the graph out once with ``engine`` and render it to every format.
+
+        engine 'nop2' keeps the positions of an already laid-out graph (neato -n2).
+        """
+        timeout = timeout or RENDER_TIMEOUTS['graphviz']
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(deadline)
+        healthy = False
+        try:
+            request = (dot_src.encode('utf-8'), list(formats), engine.encode('ascii'))
+            status, value = worker.request(request, deadline)
+            healthy = True
+        except RenderTimeout:
+            raise RenderTimeout(f'libgvc render timed out after {timeout:g}s')
+        finally:
+            # a worker that timed out or crashed is gone; the next render starts a fresh one
+            self._release(worker, healthy)
+        if status == 'error':
+            raise RenderError(value)
+        if status != 'ok':
+            raise RuntimeError(f'libgvc render failed: {value}')
+        return value
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.kill()
+
+
+@functools.lru_cache(maxsize=None)
+def graphviz_inprocess() -> Optional[LibGVC]:
+    """The libgvc backend when GRAPHVIZ_BACKEND=libgvc and its worker starts"""
+    if GRAPHVIZ_BACKEND != 'libgvc':
+        return None
     try:
-        # Prefer python-graphviz if available
-        from graphviz import Source
-        src = Source(dot_src)
-        out = src.pipe(format=format)
-        return out
-    except Exception:
-        # fallback to dot binary
-        dot_bin = shutil.which('dot')
-        if not dot_bin:
-            raise RuntimeError('graphviz not available: install python-graphviz or dot binary')
-        p = subprocess.Popen([dot_bin, f'-T{format}'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate(dot_src.encode('utf-8'))
-        if p.returncode != 0:
-            raise RuntimeError(f'dot failed: {err.decode()}')
-        return out
-
-
-def render_mermaid(mmd_text: str, format: str = 'png') -> bytes:
+        return LibGVC(os.environ.get('GRAPHVIZ_LIBGVC'), os.environ.get('GRAPHVIZ_LIBCGRAPH'),
+                      max_workers=GRAPHVIZ_MAX_CONCURRENCY)
+    except (OSError, AttributeError) as e:
+        print(f"libgvc unavailable, rendering Graphviz with {graphviz_backend().kind}: {e}", file=sys.stderr)
+        return None
+
+
+GRAPHVIZ_ENGINES = ('dot', 'neato', 'fdp', 'sfdp', 'circo', 'twopi')
+# Layout engine used when a request names none; 'auto' picks dot or sfdp by graph size
+GRAPHVIZ_ENGINE = os.environ.get('GRAPHVIZ_ENGINE', 'dot').lower()
+if GRAPHVIZ_ENGINE != 'auto' and GRAPHVIZ_ENGINE not in GRAPHVIZ_ENGINES:
+    raise ValueError(f"GRAPHVIZ_ENGINE must be 'auto' or one of {', '.join(GRAPHVIZ_ENGINES)}, "
+                     f"not {GRAPHVIZ_ENGINE!r}")
+GRAPHVIZ_AUTO_MAX_NODES = int(os.environ.get('GRAPHVIZ_AUTO_MAX_NODES', 1000))
+GRAPHVIZ_AUTO_MAX_EDGES = int(os.environ.get('GRAPHVIZ_AUTO_MAX_EDGES', 2000))
+
+_DOT_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?\*/|^[ \t]*#[^\n]*|->|--|[\w.\x80-\U0010ffff]+|<[^>]*>|[\[\]{};:=]',
+                        re.DOTALL | re.MULTILINE)
+_DOT_KEYWORDS = frozenset({'strict', 'graph', 'digraph', 'subgraph', 'node', 'edge'})
+
+
+def graphviz_graph_size(dot_src: str) -> Tuple[int, int]:
+    """Roughly count (nodes, edges) of a DOT source without parsing it fully"""
+    tokens = [t for t in _DOT_TOKEN.findall(dot_src) if not t.lstrip().startswith(('//', '/*', '#'))]
+    nodes = set()
+    edges = 0
+    depth = 0  # inside an [attribute list]
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1].lower() if i else ''
+        if token == '[':
+            depth += 1
+        elif token == ']':
+            depth = max(0, depth - 1)
+        elif depth:
+            continue
+        elif token in ('->', '--'):
+            edges += 1
+        elif token in ('{', '}', ';', ':', '=') or token.lower() in _DOT_KEYWORDS:
+            continue
+        # graph names, ports and both sides of statements such as rankdir=LR are not nodes
+        elif previous not in ('graph', 'digraph', 'subgraph', ':', '=') and tokens[i + 1:i + 2] != ['=']:
+            nodes.add(token.strip('"'))
+    return len(nodes), edges
+
+
+def select_graphviz_engine(dot_src: str, engine: Optional[str] = None) -> str:
+    """Resolve the requested layout engine, sizing the graph up for 'auto'"""
+    engine = str(engine or GRAPHVIZ_ENGINE).lower()
+    if engine == 'auto':
+        nodes, edges = graphviz_graph_size(dot_src)
+        if nodes > GRAPHVIZ_AUTO_MAX_NODES or edges > GRAPHVIZ_AUTO_MAX_EDGES:
+            return 'sfdp'
+        return 'dot'
+    if engine not in GRAPHVIZ_ENGINES:
+        raise InvalidArguments(f"unknown graphviz engine: {engine} (expected 'auto' or one of {', '.join(GRAPHVIZ_ENGINES)})")
+    return engine
+
+
+def graphviz_variant(dot_src: str, engine: Optional[str] = None) -> str:
+    """Cache key variant of a Graphviz render: its resolved layout engine, '' for dot"""
+    engine = select_graphviz_engine(dot_src, engine)
+    return '' if engine == 'dot' else engine
+
+
+# Concurrent Graphviz processes; further renders queue for a slot within their deadline
+GRAPHVIZ_MAX_CONCURRENCY = max(1, int(os.environ.get('GRAPHVIZ_MAX_CONCURRENCY', os.cpu_count() or 4)))
+# Per-process limits for dot; 0 disables a limit
+GRAPHVIZ_RLIMIT_CPU = int(os.environ.get('GRAPHVIZ_RLIMIT_CPU', 30))  # seconds
+GRAPHVIZ_RLIMIT_AS_MB = int(os.environ.get('GRAPHVIZ_RLIMIT_AS_MB', 2048))
+GRAPHVIZ_RLIMIT_OUTPUT_MB = int(os.environ.get('GRAPHVIZ_RLIMIT_OUTPUT_MB', 64))
+
+
+def apply_graphviz_rlimits(pid: int, cpu: bool = True) -> None:
+    """Cap CPU time, address space and output file size of a Graphviz process.
+
+    Set from the server with prlimit(2) once the process has started: a
+    preexec_fn would run Python in the forked child of a threaded server,
+    which can deadlock. dot reads its whole source before laying it out, so
+    limits set before the input is written are in place for the layout.
+    Only Linux has prlimit; elsewhere this does nothing.
+    """
+    if resource is None or not hasattr(resource, 'prlimit'):
+        return
+    limits = [(resource.RLIMIT_AS, GRAPHVIZ_RLIMIT_AS_MB * 1024 * 1024),
+              (resource.RLIMIT_FSIZE, GRAPHVIZ_RLIMIT_OUTPUT_MB * 1024 * 1024)]
+    if cpu:
+        limits.append((resource.RLIMIT_CPU, GRAPHVIZ_RLIMIT_CPU))
+    for which, limit in limits:
+        if limit > 0:
+            # lower only the soft limit, so dot gets SIGXCPU/SIGXFSZ rather than an outright kill
+            _, hard = resource.prlimit(pid, which)
+            resource.prlimit(pid, which, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+
+
+class GraphvizProcessPool:
+    """Caps how many Graphviz processes run at once and runs dot under rlimits.
+
+    Renders beyond the cap wait for a slot; the wait counts against their
+    deadline and is reported by stats() to size GRAPHVIZ_MAX_CONCURRENCY.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.renders = 0
+        self.queue_timeouts = 0
+        self.limit_kills = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @contextmanager
+    def slot(self, timeout: float):
+        """Hold one of the pool's slots, yielding the seconds left of ``timeout``"""
+        start = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        acquired = self._slots.acquire(timeout=timeout)
+        waited = time.monotonic() - start
+        with self._lock:
+            self.queued -= 1
+            if not acquired:
+                self.queue_timeouts += 1
+            else:
+                self.running += 1
+                self.renders += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        if not acquired:
+            raise RenderTimeout(f'graphviz render queued for {waited:.1f}s without a free slot')
+        try:
+            yield time_left(start + timeout)
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    def run(self, cmd: List[str], timeout: float, input: Optional[bytes] = None):
+        """Run dot in a slot and under the GRAPHVIZ_RLIMIT_* limits; returns (returncode, out, err).
+
+        Outputs should go to ``-o`` files, which RLIMIT_FSIZE applies to, not stdout.
+        """
+        with self.slot(timeout) as remaining:
+            returncode, out, err = _run_renderer(cmd, 'dot', remaining, input, on_start=apply_graphviz_rlimits)
+        if returncode in (-signal.SIGXCPU, -signal.SIGXFSZ):
+            # the same graph would hit the limit again, so this is cached as a failure
+            with self._lock:
+                self.limit_kills += 1
+            limit = 'CPU time' if returncode == -signal.SIGXCPU else 'output size'
+            raise RenderError(f'dot exceeded its {limit} limit')
+        if returncode < 0:
+            # crashes and the OOM killer are not necessarily the graph's fault
+            raise RuntimeError(f'dot was killed by {signal.Signals(-returncode).name}')
+        return returncode, out, err
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': self.size,
+                'running': self.running,
+                'queued': self.queued,
+                'renders': self.renders,
+                'queue_timeouts': self.queue_timeouts,
+                'limit_kills': self.limit_kills,
+                'queue_wait_avg_ms': round(self._wait_total / self.renders * 1000, 2) if self.renders else 0.0,
+                'queue_wait_max_ms': round(self._wait_max * 1000, 2),
+            }
+
+
+GRAPHVIZ_POOL = GraphvizProcessPool(GRAPHVIZ_MAX_CONCURRENCY)
+
+
+def render_graphviz(dot_src: str, format: str = 'png', timeout: Optional[float] = None,
+                    engine: str = 'dot') -> bytes:
+    """Render Graphviz with the backend resolved by graphviz_backend().
+    format: 'png' or 'svg'.
+    timeout: seconds before dot is killed (default RENDER_TIMEOUT_GRAPHVIZ)
+    engine: layout engine, one of GRAPHVIZ_ENGINES
+    """
+    return render_graphviz_formats(dot_src, [format], timeout, engine=engine)[format]
+
+
+def render_graphviz_formats(dot_src: str, formats: List[str], timeout: Optional[float] = None,
+                            layout: bool = False, engine: str = 'dot') -> Dict[str, bytes]:
+    """Lay ``dot_src`` out once with ``engine`` and render it to every format in ``formats``.
+
+    layout: ``dot_src`` is already laid out (``-Tdot`` output), so its positions
+    are reused as-is (``neato -n2``) instead of running the layout again.
+    """
+    timeout = timeout or RENDER_TIMEOUTS['graphviz']
+    formats = list(dict.fromkeys(formats))
+    lib = graphviz_inprocess()
+    if lib is not None and len(dot_src.encode('utf-8')) <= GRAPHVIZ_INPROCESS_MAX_BYTES:
+        try:
+            # a slot bounds the workers in use; taking a worker never waits
+            with GRAPHVIZ_POOL.slot(timeout) as remaining:
+                return lib.render_many(dot_src, formats, remaining, engine='nop2' if layout else engine)
+        except LibGVCBusy:
+            pass
+        except LibGVCCrashed as e:
+            print(f"{e}; rendering this graph with {graphviz_backend().kind}", file=sys.stderr)
+    backend = graphviz_backend()
+    if backend.kind == 'dot':
+        if layout:
+            cmd = [backend.path, '-Kneato', '-n2']
+        else:
+            cmd = [backend.path] + ([f'-K{engine}'] if engine != 'dot' else [])
+        src = dot_src.encode('utf-8')
+        # outputs go to files, even for one format, so RLIMIT_FSIZE bounds them
+        # and the server never buffers an oversized image from stdout
+        with tempfile.TemporaryDirectory() as td:
+            # each -o names the output of the -T before it
+            paths = {fmt: os.path.join(td, f'out{i}') for i, fmt in enumerate(formats)}
+            for fmt, path in paths.items():
+                cmd += [f'-T{fmt}', '-o', path]
+            returncode, _, err = GRAPHVIZ_POOL.run(cmd, timeout, input=src)
+            if returncode != 0:
+                raise RenderError(f'dot failed: {err.decode()}')
+            outputs = {}
+            for fmt, path in paths.items():
+                with open(path, 'rb') as f:
+                    outputs[fmt] = f.read()
+            return outputs
+    raise RuntimeError('graphviz not available: install the Graphviz dot binary')
+
+
+def render_mermaid(mmd_text: str, format: str = 'png', timeout: Optional[float] = None) -> bytes:
     """Render mermaid using mermaid-cli (mmdc). Requires node/npm and @mermaid-js/mermaid-cli available.
     We try to run `mmdc` via npx if installed locally.
+    timeout: seconds before mmdc is killed (default RENDER_TIMEOUT_MERMAID)
     """
+    timeout = timeout or RENDER_TIMEOUTS['mermaid']
     # Find mmdc: try local binary, then npx
     mmdc_bin = shutil.which('mmdc')
     use_npx = False
@@ -147,13 +1391,1077 @@ def render_mermaid(mmd_text: str, format: str = 'png') -> bytes:
             cmd = [mmdc_bin, '@mermaid-js/mermaid-cli', '-i', in_file, '-o', out_file, '-t', 'default']
         else:
             cmd = [mmdc_bin, '-i', in_file, '-o', out_file, '-t', 'default']
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        if p.returncode != 0:
-            raise RuntimeError(f'mmdc failed: {err.decode()}')
+        returncode, out, err = _run_renderer(cmd, 'mmdc', timeout)
+        if returncode != 0:
+            raise RenderError(f'mmdc failed: {err.decode()}')
         with open(out_file, 'rb') as f:
             return f.read()
 
+# -------------------- Source normalization --------------------
+# LLM-generated sources often differ only by line endings, trailing whitespace,
+# indentation or comments. Keys are computed over a canonical form so those
+# variants share one cache entry; renderers always receive the original text.
+
+RENDER_CACHE_NORMALIZE = os.environ.get('RENDER_CACHE_NORMALIZE', '1') != '0'
+
+
+def _normalize_plantuml(lines: List[str]) -> List[str]:
+    # indentation and blank lines matter in notes and in non-UML diagrams
+    # (@startditaa, @startyaml, @startjson...), so only comments and trailing
+    # whitespace are dropped, and only inside @startuml bodies
+    out = []
+    in_uml = True  # sources without @start are rendered as UML
+    in_comment = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('@start'):
+            in_uml = stripped.startswith('@startuml')
+        if not in_uml:
+            out.append(line)
+            continue
+        if in_comment:
+            in_comment = not stripped.endswith("'/")
+            continue
+        if stripped.startswith("/'") and (stripped.endswith("'/") or "'/" not in stripped):
+            in_comment = len(stripped) < 4 or not stripped.endswith("'/")
+            continue
+        if stripped.startswith("'"):
+            continue
+        out.append(line.rstrip())
+    while out and not out[-1].strip():
+        out.pop()
+    while out and not out[0].strip():
+        out.pop(0)
+    if out and out[0].strip().startswith('@startuml') and out[-1].strip().startswith('@enduml'):
+        out = out[1:-1]
+    return out
+
+
+def _normalize_dot(lines: List[str]) -> List[str]:
+    out = []
+    in_string = False
+    for line in lines:
+        if not in_string:
+            stripped = line.strip()
+            if not stripped or stripped.startswith('//') or stripped.startswith('#'):
+                continue
+            line = stripped
+        # fold whitespace outside quoted strings, keep string contents verbatim
+        chars = []
+        escaped = False
+        for ch in line:
+            if in_string:
+                chars.append(ch)
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch in ' \t':
+                if chars and chars[-1] != ' ':
+                    chars.append(' ')
+            else:
+                chars.append(ch)
+                if ch == '"':
+                    in_string = True
+        out.append(''.join(chars) if in_string else ''.join(chars).rstrip())
+    return out
+
+
+def _normalize_mermaid(lines: List[str]) -> List[str]:
+    out = []
+    for line in lines:
+        line = line.rstrip()
+        stripped = line.lstrip()
+        if not stripped:
+            continue
+        # %%{init: ...}%% directives change the output and must be kept
+        if stripped.startswith('%%') and not stripped.startswith('%%{'):
+            continue
+        # indentation is meaningful in some diagram types (e.g. mindmap)
+        out.append(line.replace('\t', '    '))
+    return out
+
+
+def normalize_source(engine: str, text: str) -> str:
+    """Canonical form of a diagram source, used only to derive cache keys"""
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if engine == 'plantuml':
+        lines = _normalize_plantuml(lines)
+    elif engine == 'graphviz':
+        lines = _normalize_dot(lines)
+    elif engine == 'mermaid':
+        lines = _normalize_mermaid(lines)
+    return '\n'.join(lines)
+
+
+# -------------------- Render cache --------------------
+# Content-addressed cache in front of the renderers. Agents resubmit the same
+# diagram constantly while iterating, so identical (engine, format, source,
+# engine version) tuples are served from memory instead of re-rendering.
+
+class CacheKey(NamedTuple):
+    engine: str
+    format: str
+    digest: str
+    version: str
+
+    @property
+    def id(self) -> str:
+        """Stable hex identifier for the whole key"""
+        raw = '\0'.join(self).encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _tool_version(binary: str, flag: str) -> str:
+    """Return the version banner of a local binary, probed once per process."""
+    path = shutil.which(binary)
+    if not path:
+        return 'unavailable'
+    try:
+        p = subprocess.run([path, flag], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+    except Exception:
+        return 'unknown'
+    # dot prints its version banner on stderr
+    return (p.stdout or p.stderr).decode('utf-8', 'replace').strip()
+
+
+def engine_version(engine: str) -> str:
+    """Identify the renderer behind an engine so upgrades invalidate cached output"""
+    if engine == 'plantuml':
+        if PLANTUML_JAR:
+            try:
+                return f'{PLANTUML_JAR}@{os.path.getmtime(PLANTUML_JAR)}'
+            except OSError:
+                pass
+        return ','.join(plantuml_server_urls())
+    if engine == 'graphviz':
+        lib = graphviz_inprocess()
+        if lib is not None:
+            return f'{graphviz_backend().version}; libgvc {lib.version}'
+        return graphviz_backend().version
+    if engine == 'mermaid':
+        if shutil.which('mmdc'):
+            return _tool_version('mmdc', '--version')
+        return 'npx'
+    raise ValueError(f'unknown engine: {engine}')
+
+
+def render_cache_key(engine: str, format: str, text: str, page: int = 0, variant: str = '') -> CacheKey:
+    """``page`` and ``variant`` (an option that changes the output, such as the
+    Graphviz layout engine) extend the digest only when set, keeping plain keys stable."""
+    if RENDER_CACHE_NORMALIZE:
+        text = normalize_source(engine, text)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    if page:
+        digest = f'{digest}#{page}'
+    if variant:
+        digest = f'{digest}@{variant}'
+    return CacheKey(engine, format, digest, engine_version(engine))
+
+
+class RenderedDiagram:
+    """A rendered image together with its base64 payload, encoded once.
+
+    Every tool path returns the base64 form, so keeping it next to the raw
+    bytes lets cache hits skip re-encoding multi-megabyte images.
+    """
+
+    __slots__ = ('data', 'data_base64')
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.data_base64 = base64.b64encode(data).decode('ascii')
+
+    @property
+    def size(self) -> int:
+        """Memory footprint charged against the cache budget"""
+        return len(self.data) + len(self.data_base64)
+
+
+def _key_matches(key: CacheKey, engine: Optional[str], key_id: Optional[str]) -> bool:
+    if engine is not None and key.engine != engine:
+        return False
+    return key_id is None or key.id == key_id
+
+
+class MemoryRenderCache:
+    """Byte-budgeted LRU cache of rendered diagrams (raw and base64-encoded)"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, RenderedDiagram]" = OrderedDict()
+        self._entry_hits: Dict[CacheKey, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[RenderedDiagram]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._entry_hits[key] += 1
+            self.hits += 1
+            return entry
+
+    def put(self, key: CacheKey, entry: RenderedDiagram) -> None:
+        size = entry.size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._entry_hits.setdefault(key, 0)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                del self._entry_hits[evicted_key]
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def purge(self, engine: Optional[str] = None, key_id: Optional[str] = None) -> int:
+        """Drop entries for an engine and/or a key id (everything when both are None)"""
+        with self._lock:
+            doomed = [k for k in self._entries if _key_matches(k, engine, key_id)]
+            for k in doomed:
+                self._bytes -= self._entries.pop(k).size
+                del self._entry_hits[k]
+            return len(doomed)
+
+    def clear(self) -> None:
+        self.purge()
+
+    def stats(self, top: int = 0) -> Dict[str, Any]:
+        with self._lock:
+            engines: Dict[str, Dict[str, int]] = {}
+            for key, entry in self._entries.items():
+                e = engines.setdefault(key.engine, {'entries': 0, 'bytes': 0})
+                e['entries'] += 1
+                e['bytes'] += entry.size
+            hottest = sorted(self._entry_hits.items(), key=lambda kv: kv[1], reverse=True)[:top]
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'engines': engines,
+                'top_keys': [
+                    {'key': k.id, 'engine': k.engine, 'format': k.format,
+                     'bytes': self._entries[k].size, 'hits': hits}
+                    for k, hits in hottest
+                ],
+            }
+
+
+class DiskRenderCache:
+    """Size-bounded on-disk cache tier that survives process restarts.
+
+    Entries live at ``<root>/<engine>/<id[:2]>/<id>``; the id covers the format,
+    which is client-supplied and never part of the path. Writes go to a
+    temporary file in the same shard and are renamed into place, so readers in
+    this or any other process never observe a partial image. The least recently
+    used files (by mtime, bumped on every hit) are removed once the tier grows
+    past ``max_bytes``.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._scan())
+
+    def _path(self, key: CacheKey) -> str:
+        key_id = key.id
+        return os.path.join(self.root, key.engine, key_id[:2], key_id)
+
+    def _scan(self):
+        """Yield (path, size, mtime) for every cached file"""
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: CacheKey, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        shard = os.path.dirname(path)
+        try:
+            os.makedirs(shard, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=shard, prefix='.tmp-')
+        except OSError:
+            # a full or read-only cache disk must never fail the render itself
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._bytes += len(data) - replaced
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Rescan so files written by other processes are accounted for, then
+        # trim to 90% of the budget to avoid rescanning on every write.
+        files = sorted(self._scan(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+    def purge(self, engine: Optional[str] = None, key_id: Optional[str] = None) -> int:
+        """Delete files for an engine and/or a key id (everything when both are None)"""
+        removed = 0
+        with self._lock:
+            for path, size, _ in list(self._scan()):
+                rel = os.path.relpath(path, self.root).split(os.sep)
+                if engine is not None and rel[0] != engine:
+                    continue
+                if key_id is not None and os.path.splitext(rel[-1])[0] != key_id:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                self._bytes -= size
+                removed += 1
+        return removed
+
+    def clear(self) -> None:
+        self.purge()
+
+    def stats(self, top: int = 0) -> Dict[str, Any]:
+        engines: Dict[str, Dict[str, int]] = {}
+        for path, size, _ in self._scan():
+            engine = os.path.relpath(path, self.root).split(os.sep)[0]
+            e = engines.setdefault(engine, {'entries': 0, 'bytes': 0})
+            e['entries'] += 1
+            e['bytes'] += size
+        lookups = self.hits + self.misses
+        return {
+            'path': self.root,
+            'entries': sum(e['entries'] for e in engines.values()),
+            'bytes': sum(e['bytes'] for e in engines.values()),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'engines': engines,
+        }
+
+
+class SQLiteRenderCache:
+    """Render cache shared by every worker process on a host.
+
+    Backed by a single SQLite database in WAL mode, so any number of uvicorn
+    workers can read concurrently while one writes. Each thread gets its own
+    connection; lock contention beyond ``busy_timeout`` is treated as a miss
+    rather than failing the render. The total size lives in the database
+    itself, kept up to date by triggers, so every process trims against the
+    same figure and the budget holds however many workers write.
+    """
+
+    # Access times are only rewritten when older than this, so hot entries do
+    # not turn every read into a write transaction.
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        conn = self._conn()
+        with self._write(conn):
+            # the blob goes last so reading sizes and access times skips its overflow pages
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS renders ('
+                'id TEXT PRIMARY KEY, engine TEXT NOT NULL, format TEXT NOT NULL, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL, data BLOB NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS renders_accessed ON renders (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS renders_size ('
+                         'id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO renders_size (id, bytes) '
+                         'SELECT 0, COALESCE(SUM(size), 0) FROM renders')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS renders_size_insert AFTER INSERT ON renders '
+                         'BEGIN UPDATE renders_size SET bytes = bytes + NEW.size; END')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS renders_size_delete AFTER DELETE ON renders '
+                         'BEGIN UPDATE renders_size SET bytes = bytes - OLD.size; END')
+
+    @staticmethod
+    @contextmanager
+    def _write(conn: sqlite3.Connection):
+        """Write transaction, taking the database write lock up front"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _total(conn: sqlite3.Connection) -> int:
+        return conn.execute('SELECT bytes FROM renders_size').fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        key_id = key.id
+        try:
+            conn = self._conn()
+            row = conn.execute('SELECT data, accessed FROM renders WHERE id = ?', (key_id,)).fetchone()
+            if row is not None:
+                now = time.time()
+                if now - row[1] > self.TOUCH_INTERVAL:
+                    conn.execute('UPDATE renders SET accessed = ? WHERE id = ?', (now, key_id))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bytes(row[0])
+
+    def put(self, key: CacheKey, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        key_id = key.id
+        try:
+            conn = self._conn()
+            with self._write(conn):
+                # DELETE + INSERT rather than INSERT OR REPLACE: REPLACE skips delete triggers
+                conn.execute('DELETE FROM renders WHERE id = ?', (key_id,))
+                conn.execute(
+                    'INSERT INTO renders (id, engine, format, size, accessed, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    (key_id, key.engine, key.format, len(data), time.time(), sqlite3.Binary(data)),
+                )
+                # trimming in the same transaction keeps the table within budget
+                # for every reader, whichever process wrote last
+                if self._total(conn) > self.max_bytes:
+                    self._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # trim to 90% of the budget to avoid evicting on every write
+        total = self._total(conn)
+        target = self.max_bytes * 0.9
+        doomed = []
+        for key_id, size in conn.execute('SELECT id, size FROM renders ORDER BY accessed, rowid'):
+            if total <= target:
+                break
+            doomed.append((key_id,))
+            total -= size
+        conn.executemany('DELETE FROM renders WHERE id = ?', doomed)
+        with self._lock:
+            self.evictions += len(doomed)
+
+    def purge(self, engine: Optional[str] = None, key_id: Optional[str] = None) -> int:
+        """Delete rows for an engine and/or a key id (everything when both are None)"""
+        clauses, params = [], []
+        if engine is not None:
+            clauses.append('engine = ?')
+            params.append(engine)
+        if key_id is not None:
+            clauses.append('id = ?')
+            params.append(key_id)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        try:
+            conn = self._conn()
+            return conn.execute(f'DELETE FROM renders{where}', params).rowcount
+        except sqlite3.Error:
+            return 0
+
+    def clear(self) -> None:
+        self.purge()
+
+    def stats(self, top: int = 0) -> Dict[str, Any]:
+        engines: Dict[str, Dict[str, int]] = {}
+        top_keys = []
+        try:
+            conn = self._conn()
+            for engine, entries, total in conn.execute(
+                'SELECT engine, COUNT(*), SUM(size) FROM renders GROUP BY engine'
+            ):
+                engines[engine] = {'entries': entries, 'bytes': total}
+            if top:
+                # no per-row hit counter here; report the most recently used rows
+                top_keys = [
+                    {'key': key_id, 'engine': engine, 'format': fmt, 'bytes': size}
+                    for key_id, engine, fmt, size in conn.execute(
+                        'SELECT id, engine, format, size FROM renders ORDER BY accessed DESC LIMIT ?', (top,)
+                    )
+                ]
+        except sqlite3.Error:
+            pass
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'entries': sum(e['entries'] for e in engines.values()),
+            'bytes': sum(e['bytes'] for e in engines.values()),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'engines': engines,
+            'recent_keys': top_keys,
+        }
+
+
+RENDER_CACHE = MemoryRenderCache(int(os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+# Slower shared tiers consulted, in order, after a memory miss
+RENDER_CACHE_TIERS: List[Any] = []
+if os.environ.get('RENDER_CACHE_DIR'):
+    RENDER_CACHE_TIERS.append(DiskRenderCache(
+        os.environ['RENDER_CACHE_DIR'],
+        int(os.environ.get('RENDER_CACHE_DIR_MAX_BYTES', 1024 * 1024 * 1024)),
+    ))
+if os.environ.get('RENDER_CACHE_SQLITE'):
+    RENDER_CACHE_TIERS.append(SQLiteRenderCache(
+        os.environ['RENDER_CACHE_SQLITE'],
+        int(os.environ.get('RENDER_CACHE_SQLITE_MAX_BYTES', 1024 * 1024 * 1024)),
+    ))
+
+
+class NegativeRenderCache:
+    """Remember recent render failures so verbatim retries fail fast.
+
+    Only deterministic failures are recorded (see ``is_deterministic_failure``);
+    timeouts and connection errors are always retried. ``renders_avoided``
+    counts renders skipped thanks to a cached failure.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.renders_avoided = 0
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, message = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self.renders_avoided += 1
+            return message
+
+    def put(self, key: CacheKey, message: str) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, message)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self, engine: Optional[str] = None, key_id: Optional[str] = None) -> int:
+        with self._lock:
+            doomed = [k for k in self._entries if _key_matches(k, engine, key_id)]
+            for k in doomed:
+                del self._entries[k]
+            return len(doomed)
+
+    def clear(self) -> None:
+        self.purge()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'ttl': self.ttl,
+                'renders_avoided': self.renders_avoided,
+            }
+
+
+HTTP_STATUS_ERRORS = (requests.HTTPError,) + ((httpx.HTTPStatusError,) if httpx is not None else ())
+HTTP_TIMEOUT_ERRORS = (requests.Timeout,) + ((httpx.TimeoutException,) if httpx is not None else ())
+
+
+def is_deterministic_failure(exc: BaseException) -> bool:
+    """True when retrying the same source cannot succeed (syntax errors, 4xx)"""
+    if isinstance(exc, RenderError):
+        return True
+    if isinstance(exc, HTTP_STATUS_ERRORS) and exc.response is not None:
+        status = exc.response.status_code
+        return 400 <= status < 500 and status not in (408, 429)
+    return False
+
+
+RENDER_FAILURES = NegativeRenderCache(float(os.environ.get('RENDER_NEGATIVE_TTL', 30)))
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution.
+
+    The first caller runs the work; callers arriving while it is in flight
+    block until it finishes and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, _Flight] = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout: Optional[float] = None):
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise RenderTimeout('timed out waiting for an identical in-flight render')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'in_flight': len(self._calls), 'coalesced': self.coalesced}
+
+
+RENDER_FLIGHTS = SingleFlight()
+
+
+def _render(engine: str, text: str, format: str, page: int = 0, timeout: Optional[float] = None,
+            variant: str = '') -> bytes:
+    if engine == 'plantuml':
+        return render_plantuml(text, format=format, page=page, timeout=timeout)
+    if engine == 'graphviz':
+        layout = _cached_graphviz_layout(text, variant)
+        if layout is not None:
+            return render_graphviz_formats(layout.decode('utf-8'), [format], timeout, layout=True)[format]
+        return render_graphviz(text, format=format, timeout=timeout, engine=variant or 'dot')
+    if engine == 'mermaid':
+        return render_mermaid(text, format=format, timeout=timeout)
+    raise ValueError(f'unknown engine: {engine}')
+
+
+def render_cached(engine: str, text: str, format: str, page: int = 0,
+                  timeout: Optional[float] = None, variant: Optional[str] = None) -> RenderedDiagram:
+    """Render a diagram, serving repeat requests from RENDER_CACHE and its tiers.
+
+    Concurrent misses for the same key share one render via RENDER_FLIGHTS.
+    ``timeout`` defaults to the engine's RENDER_TIMEOUT_* setting; ``variant``
+    is the Graphviz layout engine when it is not dot, by default the one
+    GRAPHVIZ_ENGINE picks for ``text``.
+    """
+    timeout = timeout or RENDER_TIMEOUTS[engine]
+    if variant is None:
+        variant = graphviz_variant(text) if engine == 'graphviz' else ''
+    key = render_cache_key(engine, format, text, page, variant)
+    rendered = RENDER_CACHE.get(key)
+    if rendered is not None:
+        return rendered
+    failure = RENDER_FAILURES.get(key)
+    if failure is not None:
+        raise RenderError(failure)
+    return RENDER_FLIGHTS.do(key, lambda: _render_and_fill(key, text, page, timeout, variant), timeout)
+
+
+def _render_and_fill(key: CacheKey, text: str, page: int = 0, timeout: Optional[float] = None,
+                     variant: str = '') -> RenderedDiagram:
+    rendered = _lookup_tiers(key)
+    if rendered is not None:
+        return rendered
+    try:
+        data = _render(key.engine, text, key.format, page, timeout, variant)
+    except Exception as e:
+        if is_deterministic_failure(e):
+            RENDER_FAILURES.put(key, str(e))
+        raise
+    return _fill(key, data)
+
+
+def _lookup_tiers(key: CacheKey) -> Optional[RenderedDiagram]:
+    # tiers hold raw bytes; the base64 form is only kept in memory
+    for i, tier in enumerate(RENDER_CACHE_TIERS):
+        data = tier.get(key)
+        if data is not None:
+            # promote into the faster tiers in front of this one
+            for faster in RENDER_CACHE_TIERS[:i]:
+                faster.put(key, data)
+            rendered = RenderedDiagram(data)
+            RENDER_CACHE.put(key, rendered)
+            return rendered
+    return None
+
+
+def _fill(key: CacheKey, data: bytes) -> RenderedDiagram:
+    rendered = RenderedDiagram(data)
+    RENDER_CACHE.put(key, rendered)
+    for tier in RENDER_CACHE_TIERS:
+        tier.put(key, data)
+    return rendered
+
+
+def render_plantuml_blocks(text: str, format: str, timeout: Optional[float] = None) -> List[RenderedDiagram]:
+    """Render each ``@startuml ... @enduml`` block of ``text`` as its own diagram.
+
+    Cached blocks are served from the cache; the misses are rendered together
+    in one batch (see render_plantuml_batch). Every block that renders is
+    cached even when another fails; the first failure is then raised, naming
+    its zero-based block index.
+    """
+    blocks = split_plantuml_blocks(text) or [text]
+    keys = [render_cache_key('plantuml', format, block) for block in blocks]
+    results: Dict[CacheKey, Union[RenderedDiagram, Exception]] = {}
+    for key in keys:
+        if key in results:
+            continue
+        rendered = RENDER_CACHE.get(key) or _lookup_tiers(key)
+        if rendered is None:
+            failure = RENDER_FAILURES.get(key)
+            if failure is not None:
+                rendered = RenderError(failure)
+        if rendered is not None:
+            results[key] = rendered
+    # identical blocks share a key and are only rendered once
+    pending = {key: block for key, block in zip(keys, blocks) if key not in results}
+    if pending:
+        outputs = render_plantuml_batch(list(pending.values()), format, timeout=timeout)
+        for key, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                if is_deterministic_failure(output):
+                    RENDER_FAILURES.put(key, str(output))
+                results[key] = output
+            else:
+                results[key] = _fill(key, output)
+    for i, key in enumerate(keys):
+        error = results[key]
+        if isinstance(error, Exception):
+            if is_deterministic_failure(error):
+                raise RenderError(f'block {i}: {error}') from error
+            raise error
+    return [results[key] for key in keys]
+
+
+# Cache pseudo-format holding a graph's -Tdot output, positions included
+GRAPHVIZ_LAYOUT_FORMAT = 'layout'
+
+
+def _cached_graphviz_layout(text: str, variant: str = '') -> Optional[bytes]:
+    key = render_cache_key('graphviz', GRAPHVIZ_LAYOUT_FORMAT, text, variant=variant)
+    rendered = RENDER_CACHE.get(key) or _lookup_tiers(key)
+    return rendered.data if rendered is not None else None
+
+
+def render_graphviz_formats_cached(text: str, formats: List[str], timeout: Optional[float] = None,
+                                   engine: str = 'dot') -> List[RenderedDiagram]:
+    """Render a graph to several formats from a single layout, one image per format.
+
+    The layout is cached too, so a later request for another format of the
+    same graph only renders, without laying the graph out again.
+    """
+    formats = list(dict.fromkeys(formats))
+    deadline = time.monotonic() + (timeout or RENDER_TIMEOUTS['graphviz'])
+    variant = '' if engine == 'dot' else engine
+    keys = {fmt: render_cache_key('graphviz', fmt, text, variant=variant) for fmt in formats}
+    layout_key = render_cache_key('graphviz', GRAPHVIZ_LAYOUT_FORMAT, text, variant=variant)
+    images = {fmt: RENDER_CACHE.get(key) or _lookup_tiers(key) for fmt, key in keys.items()}
+    missing = [fmt for fmt, image in images.items() if image is None]
+    for fmt in missing:
+        failure = RENDER_FAILURES.get(keys[fmt])
+        if failure is not None:
+            raise RenderError(failure)
+
+    def render_missing(wanted: List[str]) -> Callable[[], Dict[str, RenderedDiagram]]:
+        def run() -> Dict[str, RenderedDiagram]:
+            # an earlier flight may have rendered some of these already
+            found = {fmt: RENDER_CACHE.get(keys[fmt]) or _lookup_tiers(keys[fmt]) for fmt in wanted}
+            todo = [fmt for fmt, image in found.items() if image is None]
+            if not todo:
+                return found
+            layout = _cached_graphviz_layout(text, variant)
+            try:
+                if layout is not None:
+                    outputs = render_graphviz_formats(layout.decode('utf-8'), todo, time_left(deadline), layout=True)
+                else:
+                    outputs = render_graphviz_formats(text, todo + ['dot'], time_left(deadline), engine=engine)
+                    _fill(layout_key, outputs['dot'])
+            except Exception as e:
+                if is_deterministic_failure(e):
+                    for fmt in todo:
+                        RENDER_FAILURES.put(keys[fmt], str(e))
+                raise
+            found.update({fmt: _fill(keys[fmt], outputs[fmt]) for fmt in todo})
+            return found
+        return run
+
+    # Concurrent requests for the same graph share one layout. A request that
+    # joined a flight for other formats renders the rest from the cached
+    # layout in a flight of its own.
+    while missing:
+        done = RENDER_FLIGHTS.do(layout_key, render_missing(missing), time_left(deadline))
+        for fmt in missing:
+            images[fmt] = done.get(fmt) or RENDER_CACHE.get(keys[fmt]) or _lookup_tiers(keys[fmt])
+        missing = [fmt for fmt in missing if images[fmt] is None]
+    return [images[fmt] for fmt in formats]
+
+
+def render_plantuml_pages(text: str, format: str, timeout: Optional[float] = None) -> List[RenderedDiagram]:
+    """Render every ``newpage`` page of a PlantUML diagram concurrently, one image per page"""
+    pages = count_plantuml_pages(text)
+    if pages == 1:
+        return [render_cached('plantuml', text, format, timeout=timeout)]
+    deadline = time.monotonic() + (timeout or RENDER_TIMEOUTS['plantuml'])
+    workers = min(pages, PLANTUML_POOL_SIZE)
+    pool = plantuml_jvm_pool()
+    if pool is not None:
+        # never run more pages at once than there are local workers
+        workers = min(workers, pool.max_workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plantuml-page') as executor:
+        return list(executor.map(
+            lambda page: render_cached('plantuml', text, format, page, timeout=time_left(deadline)),
+            range(pages)))
+
+
+# -------------------- Cache administration --------------------
+
+def cache_stats(top: int = 10) -> Dict[str, Any]:
+    """Snapshot of every cache layer, for tuning budgets at runtime"""
+    return {
+        'memory': RENDER_CACHE.stats(top=top),
+        'tiers': [dict(tier.stats(top=top), type=type(tier).__name__) for tier in RENDER_CACHE_TIERS],
+        'negative': RENDER_FAILURES.stats(),
+        'single_flight': RENDER_FLIGHTS.stats(),
+        'graphviz_pool': GRAPHVIZ_POOL.stats(),
+        'warmup': CACHE_WARMUP.progress(),
+    }
+
+
+def purge_cache(engine: Optional[str] = None, key: Optional[str] = None) -> Dict[str, Any]:
+    """Remove cached renders (and failures) by engine and/or key id; all of them when neither is given"""
+    return {
+        'memory': RENDER_CACHE.purge(engine, key),
+        'tiers': [tier.purge(engine, key) for tier in RENDER_CACHE_TIERS],
+        'negative': RENDER_FAILURES.purge(engine, key),
+    }
+
+
+def run_cache_admin(arguments: dict) -> Dict[str, Any]:
+    """Execute the cache.admin tool"""
+    action = arguments.get('action', 'stats')
+    if action == 'stats':
+        return cache_stats(int(arguments.get('top', 10)))
+    if action == 'purge':
+        return {'purged': purge_cache(arguments.get('engine'), arguments.get('key'))}
+    raise ValueError(f"unknown cache.admin action: {action}")
+
+
+class PurgeRequest(BaseModel):
+    engine: Optional[str] = None
+    key: Optional[str] = None
+
+
+@app.post('/cache_stats')
+async def cache_stats_endpoint(top: int = 10):
+    return {'ok': True, 'stats': cache_stats(top)}
+
+
+@app.post('/cache_purge')
+async def cache_purge_endpoint(req: PurgeRequest):
+    return {'ok': True, 'purged': purge_cache(req.engine, req.key)}
+
+
+# -------------------- Cache warm-up --------------------
+# Pre-render a known corpus of diagrams into the render cache right after
+# startup, so the first requests after a deploy are cache hits.
+
+# file extension -> (engine, default format)
+WARMUP_EXTENSIONS = {
+    '.puml': ('plantuml', 'svg'),
+    '.plantuml': ('plantuml', 'svg'),
+    '.dot': ('graphviz', 'png'),
+    '.gv': ('graphviz', 'png'),
+    '.mmd': ('mermaid', 'png'),
+}
+
+
+class CacheWarmup:
+    """Background pre-rendering of a diagram directory with bounded parallelism"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.directory: Optional[str] = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started = False
+        self.finished = False
+
+    def _jobs(self, directory: str, formats: Optional[List[str]]):
+        for dirpath, _, filenames in os.walk(directory):
+            for name in sorted(filenames):
+                engine_fmt = WARMUP_EXTENSIONS.get(os.path.splitext(name)[1].lower())
+                if engine_fmt is None:
+                    continue
+                engine, default_fmt = engine_fmt
+                for fmt in formats or [default_fmt]:
+                    yield os.path.join(dirpath, name), engine, fmt
+
+    def _warm_one(self, path: str, engine: str, fmt: str) -> None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                render_cached(engine, f.read(), fmt)
+            ok = True
+        except Exception:
+            ok = False
+        with self._lock:
+            self.done += 1
+            if not ok:
+                self.failed += 1
+
+    def _run(self, jobs, concurrency: int) -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='cache-warmup') as pool:
+                for job in jobs:
+                    pool.submit(self._warm_one, *job)
+        finally:
+            self.finished = True
+
+    def start(self, directory: str, concurrency: int = 2, formats: Optional[List[str]] = None) -> threading.Thread:
+        jobs = list(self._jobs(directory, formats))
+        with self._lock:
+            self.directory = directory
+            self.total = len(jobs)
+            self.started = True
+        thread = threading.Thread(target=self._run, args=(jobs, max(1, concurrency)), name='cache-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def ready(self) -> bool:
+        return not self.started or self.finished
+
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'total': self.total,
+                'done': self.done,
+                'failed': self.failed,
+                'finished': self.finished,
+            }
+
+
+CACHE_WARMUP = CacheWarmup()
+
+
+def start_cache_warmup(directory: Optional[str] = None) -> Optional[threading.Thread]:
+    """Start warming the cache from RENDER_CACHE_WARM_DIR (or ``directory``), if configured"""
+    directory = directory or os.environ.get('RENDER_CACHE_WARM_DIR')
+    if not directory or CACHE_WARMUP.started:
+        return None
+    if not os.path.isdir(directory):
+        print(f"Cache warm-up directory not found: {directory}", file=sys.stderr)
+        return None
+    formats = [f.strip() for f in os.environ.get('RENDER_CACHE_WARM_FORMATS', '').split(',') if f.strip()]
+    concurrency = int(os.environ.get('RENDER_CACHE_WARM_CONCURRENCY', 2))
+    return CACHE_WARMUP.start(directory, concurrency, formats or None)
+
+
+@app.get('/ready')
+async def ready():
+    """Readiness probe: 503 until the startup cache warm-up has finished"""
+    body = {'ready': CACHE_WARMUP.ready, 'warmup': CACHE_WARMUP.progress()}
+    return JSONResponse(body, status_code=200 if body['ready'] else 503)
+
+
 # -------------------- MCP-like server implementation --------------------
 
 class CallRequest(BaseModel):
@@ -167,6 +2475,63 @@ async def list_tools():
     return {'ok': True, 'tools': tools}
 
 
+def render_plantuml_tool(text: str, fmt: str, arguments: dict) -> List[RenderedDiagram]:
+    """Render plantuml.render input, one image per block (``batch``) and/or page (``split_pages``)"""
+    timeout = render_timeout('plantuml', arguments.get('timeout'))
+    if arguments.get('split_pages'):
+        deadline = time.monotonic() + timeout
+        blocks = (split_plantuml_blocks(text) or [text]) if arguments.get('batch') else [text]
+        return [image for block in blocks for image in render_plantuml_pages(block, fmt, time_left(deadline))]
+    if arguments.get('batch'):
+        return render_plantuml_blocks(text, fmt, timeout)
+    return [render_cached('plantuml', text, fmt, timeout=timeout)]
+
+
+def render_graphviz_tool(text: str, fmt: str, arguments: dict) -> Tuple[List[str], List[RenderedDiagram]]:
+    """Render graphviz.render input; returns (formats, images), one image per format"""
+    timeout = render_timeout('graphviz', arguments.get('timeout'))
+    engine = select_graphviz_engine(text, arguments.get('engine'))
+    formats = arguments.get('formats')
+    if not formats:
+        media_type('graphviz', fmt)
+        variant = '' if engine == 'dot' else engine
+        return [fmt], [render_cached('graphviz', text, fmt, timeout=timeout, variant=variant)]
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    formats = list(dict.fromkeys(str(f).strip() for f in formats if str(f).strip()))
+    for f in formats:
+        media_type('graphviz', f)
+    return formats, render_graphviz_formats_cached(text, formats, timeout, engine)
+
+
+def _content_types(ctype: Union[str, List[str]], images: List[RenderedDiagram]) -> List[str]:
+    # one content type for every image, or a list with one per image
+    return list(ctype) if isinstance(ctype, list) else [ctype] * len(images)
+
+
+def call_tool_result(ctype: Union[str, List[str]], images: List[RenderedDiagram]) -> Dict[str, Any]:
+    """Build the /call_tool result; the first image doubles as the single-image result"""
+    media_types = _content_types(ctype, images)
+    result = {'content_type': media_types[0], 'data_base64': images[0].data_base64}
+    if len(images) > 1:
+        result['images'] = [{'content_type': t, 'data_base64': image.data_base64}
+                            for t, image in zip(media_types, images)]
+    return result
+
+
+def mcp_image_content(ctype: Union[str, List[str]], images: List[RenderedDiagram]) -> List[Dict[str, Any]]:
+    """Build MCP tool content: a status line followed by one image item per diagram"""
+    media_types = _content_types(ctype, images)
+    kinds = ', '.join(dict.fromkeys(media_types))
+    if len(images) == 1:
+        summary = f"Diagram rendered successfully as {kinds}"
+    else:
+        summary = f"{len(images)} diagrams rendered successfully as {kinds}"
+    return [{"type": "text", "text": summary}] + [
+        {"type": "image", "mimeType": t, "data": image.data_base64} for t, image in zip(media_types, images)
+    ]
+
+
 @app.post('/call_tool')
 async def call_tool(req: CallRequest):
     try:
@@ -175,36 +2540,92 @@ async def call_tool(req: CallRequest):
             if not text:
                 raise HTTPException(status_code=400, detail='text is required')
             fmt = req.arguments.get('format', 'svg')
-            data = render_plantuml(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
-            return {'ok': True, 'result': {'content_type': ctype, 'data_base64': base64.b64encode(data).decode('ascii')}}
+            ctype = media_type('plantuml', fmt)
+            images = await run_in_threadpool(render_plantuml_tool, text, fmt, req.arguments)
+            return {'ok': True, 'result': call_tool_result(ctype, images)}
 
         elif req.name == 'graphviz.render':
             text = req.arguments.get('text')
             if not text:
                 raise HTTPException(status_code=400, detail='text is required')
             fmt = req.arguments.get('format', 'png')
-            data = render_graphviz(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
-            return {'ok': True, 'result': {'content_type': ctype, 'data_base64': base64.b64encode(data).decode('ascii')}}
+            formats, images = await run_in_threadpool(render_graphviz_tool, text, fmt, req.arguments)
+            ctype = [media_type('graphviz', f) for f in formats]
+            return {'ok': True, 'result': call_tool_result(ctype, images)}
 
         elif req.name == 'mermaid.render':
             text = req.arguments.get('text')
             if not text:
                 raise HTTPException(status_code=400, detail='text is required')
             fmt = req.arguments.get('format', 'png')
-            data = render_mermaid(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
-            return {'ok': True, 'result': {'content_type': ctype, 'data_base64': base64.b64encode(data).decode('ascii')}}
+            ctype = media_type('mermaid', fmt)
+            timeout = render_timeout('mermaid', req.arguments.get('timeout'))
+            rendered = await run_in_threadpool(render_cached, 'mermaid', text, fmt, timeout=timeout)
+            return {'ok': True, 'result': call_tool_result(ctype, [rendered])}
+
+        elif req.name == 'cache.admin':
+            return {'ok': True, 'result': run_cache_admin(req.arguments)}
 
         else:
             raise HTTPException(status_code=404, detail='tool not found')
     except HTTPException:
         raise
+    except InvalidArguments as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RenderTimeout as e:
+        return JSONResponse(status_code=504, content={'ok': False, 'error': str(e), 'timeout': True})
     except Exception as e:
         return {'ok': False, 'error': str(e)}
 
 
+# -------------------- Cacheable GET rendering --------------------
+# GET /render/{engine}/{format}/{encoded} returns raw image bytes so browsers,
+# reverse proxies and CDNs can cache them. The source is encoded the same way
+# as PlantUML server URLs (raw deflate + PlantUML base64) for every engine.
+
+_IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.replace('W/', '', 1) == etag:
+            return True
+    return False
+
+
+@app.get('/render/{engine}/{format}/{encoded}')
+async def render_get(engine: str, format: str, encoded: str, request: Request):
+    if engine not in ('plantuml', 'graphviz', 'mermaid'):
+        raise HTTPException(status_code=404, detail=f'unknown engine: {engine}')
+    if format not in RENDER_FORMATS[engine]:
+        raise HTTPException(status_code=400, detail=f'unsupported format: {format}')
+    try:
+        text = plantuml_server_key_to_text(encoded)
+    except (ValueError, zlib.error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail='invalid encoded diagram source')
+
+    # The key is content-addressed, so the ETag is known before rendering
+    variant = graphviz_variant(text) if engine == 'graphviz' else ''
+    etag = f'"{render_cache_key(engine, format, text, variant=variant).id}"'
+    headers = {'ETag': etag, 'Cache-Control': _IMMUTABLE}
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        rendered = await run_in_threadpool(render_cached, engine, text, format, variant=variant)
+    except Exception as e:
+        if isinstance(e, RenderTimeout):
+            status = 504
+        else:
+            status = 422 if is_deterministic_failure(e) else 502
+        return JSONResponse({'ok': False, 'error': str(e)}, status_code=status,
+                            headers={'Cache-Control': 'no-store'})
+    return Response(content=rendered.data, media_type=RENDER_FORMATS[engine][format], headers=headers)
+
+
 # -------------------- MCP SSE (Server-Sent Events) Endpoints --------------------
 
 @app.post('/sse')
@@ -231,7 +2652,9 @@ async def mcp_sse_endpoint(request: Request):
         elif method == "tools/list":
             response = handle_sse_list_tools(request_id)
         elif method == "tools/call":
-            response = handle_sse_call_tool(
+            # render off the event loop so concurrent requests can coalesce
+            response = await run_in_threadpool(
+                handle_sse_call_tool,
                 request_id,
                 params.get("name"),
                 params.get("arguments", {})
@@ -326,8 +2749,8 @@ def handle_sse_call_tool(request_id, name: str, arguments: dict):
                     "error": {"code": -32602, "message": "text is required for plantuml.render"}
                 }
             fmt = arguments.get('format', 'svg')
-            data = render_plantuml(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+            ctype = media_type('plantuml', fmt)
+            images = render_plantuml_tool(text, fmt, arguments)
             
         elif name == 'graphviz.render':
             text = arguments.get('text')
@@ -338,8 +2761,8 @@ def handle_sse_call_tool(request_id, name: str, arguments: dict):
                     "error": {"code": -32602, "message": "text is required for graphviz.render"}
                 }
             fmt = arguments.get('format', 'png')
-            data = render_graphviz(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+            formats, images = render_graphviz_tool(text, fmt, arguments)
+            ctype = [media_type('graphviz', f) for f in formats]
             
         elif name == 'mermaid.render':
             text = arguments.get('text')
@@ -350,8 +2773,19 @@ def handle_sse_call_tool(request_id, name: str, arguments: dict):
                     "error": {"code": -32602, "message": "text is required for mermaid.render"}
                 }
             fmt = arguments.get('format', 'png')
-            data = render_mermaid(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+            ctype = media_type('mermaid', fmt)
+            timeout = render_timeout('mermaid', arguments.get('timeout'))
+            images = [render_cached('mermaid', text, fmt, timeout=timeout)]
+        elif name == 'cache.admin':
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "result": {
+                    "content": [
+                        {"type": "text", "text": json.dumps(run_cache_admin(arguments), indent=2)}
+                    ]
+                }
+            }
         else:
             return {
                 "jsonrpc": "2.0",
@@ -363,17 +2797,23 @@ def handle_sse_call_tool(request_id, name: str, arguments: dict):
             "jsonrpc": "2.0",
             "id": request_id,
             "result": {
-                "content": [
-                    {
-                        "type": "text",
-                        "text": f"Diagram rendered successfully as {ctype}"
-                    },
-                    {
-                        "type": "image",
-                        "mimeType": ctype,
-                        "data": base64.b64encode(data).decode('ascii')
-                    }
-                ]
+                "content": mcp_image_content(ctype, images)
+            }
+        }
+    except InvalidArguments as e:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": -32602, "message": str(e)}
+        }
+    except RenderTimeout as e:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {
+                "code": -32001,
+                "message": "Render timed out",
+                "data": str(e)
             }
         }
     except Exception as e:
@@ -407,6 +2847,9 @@ def get_tools_list():
             'arguments': {
                 'text': 'string (PlantUML script)',
                 'format': "string, 'svg' or 'png' (optional, default 'svg')",
+                'batch': 'boolean, render each @startuml/@enduml block as its own image in one engine pass (optional, default false)',
+                'split_pages': 'boolean, render each newpage page concurrently as its own image (optional, default false)',
+                'timeout': 'number of seconds before the render is abandoned (optional, default per engine)',
             }
         },
         {
@@ -415,6 +2858,9 @@ def get_tools_list():
             'arguments': {
                 'text': 'string (Graphviz DOT source)',
                 'format': "string, 'png' or 'svg' (optional, default 'png')",
+                'formats': "string, comma-separated formats rendered from one layout, e.g. 'svg,png' (optional, overrides format)",
+                'engine': "string, layout engine: 'dot', 'neato', 'fdp', 'sfdp', 'circo', 'twopi' or 'auto' (optional, default 'dot')",
+                'timeout': 'number of seconds before the render is abandoned (optional, default per engine)',
             }
         },
         {
@@ -423,6 +2869,17 @@ def get_tools_list():
             'arguments': {
                 'text': 'string (Mermaid source)',
                 'format': "string, 'png' or 'svg' (optional, default 'png')",
+                'timeout': 'number of seconds before the render is abandoned (optional, default per engine)',
+            }
+        },
+        {
+            'name': 'cache.admin',
+            'description': 'Inspect render cache statistics or purge cached renders',
+            'arguments': {
+                'action': "string, 'stats' or 'purge' (optional, default 'stats')",
+                'engine': "string, 'plantuml', 'graphviz' or 'mermaid' (optional, purge only this engine)",
+                'key': 'string (optional, purge only this cache key id)',
+                'top': 'number of hottest keys to report (optional, default 10)',
             }
         }
     ]
@@ -525,8 +2982,8 @@ def handle_mcp_call_tool(request_id, name: str, arguments: dict):
                 write_mcp_error(request_id, -32602, 'text is required for plantuml.render')
                 return
             fmt = arguments.get('format', 'svg')
-            data = render_plantuml(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+            ctype = media_type('plantuml', fmt)
+            images = render_plantuml_tool(text, fmt, arguments)
             
         elif name == 'graphviz.render':
             text = arguments.get('text')
@@ -534,8 +2991,8 @@ def handle_mcp_call_tool(request_id, name: str, arguments: dict):
                 write_mcp_error(request_id, -32602, 'text is required for graphviz.render')
                 return
             fmt = arguments.get('format', 'png')
-            data = render_graphviz(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+            formats, images = render_graphviz_tool(text, fmt, arguments)
+            ctype = [media_type('graphviz', f) for f in formats]
             
         elif name == 'mermaid.render':
             text = arguments.get('text')
@@ -543,8 +3000,20 @@ def handle_mcp_call_tool(request_id, name: str, arguments: dict):
                 write_mcp_error(request_id, -32602, 'text is required for mermaid.render')
                 return
             fmt = arguments.get('format', 'png')
-            data = render_mermaid(text, format=fmt)
-            ctype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+            ctype = media_type('mermaid', fmt)
+            timeout = render_timeout('mermaid', arguments.get('timeout'))
+            images = [render_cached('mermaid', text, fmt, timeout=timeout)]
+        elif name == 'cache.admin':
+            write_mcp_response({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "result": {
+                    "content": [
+                        {"type": "text", "text": json.dumps(run_cache_admin(arguments), indent=2)}
+                    ]
+                }
+            })
+            return
         else:
             write_mcp_error(request_id, -32601, f"Unknown tool: {name}")
             return
@@ -554,19 +3023,13 @@ def handle_mcp_call_tool(request_id, name: str, arguments: dict):
             "jsonrpc": "2.0",
             "id": request_id,
             "result": {
-                "content": [
-                    {
-                        "type": "text",
-                        "text": f"Diagram rendered successfully as {ctype}"
-                    },
-                    {
-                        "type": "image",
-                        "mimeType": ctype,
-                        "data": base64.b64encode(data).decode('ascii')
-                    }
-                ]
+                "content": mcp_image_content(ctype, images)
             }
         })
+    except InvalidArguments as e:
+        write_mcp_error(request_id, -32602, str(e))
+    except RenderTimeout as e:
+        write_mcp_error(request_id, -32001, "Render timed out", str(e))
     except Exception as e:
         write_mcp_error(request_id, -32603, "Tool execution failed", str(e))
 
@@ -632,11 +3095,17 @@ if __name__ == '__main__':
     parser.add_argument('--mcp', action='store_true', help='Run in MCP stdio mode')
     parser.add_argument('--http', action='store_true', help='Run in HTTP mode (default)')
     parser.add_argument('--port', type=int, default=8050, help='HTTP port (default: 8050)')
+    parser.add_argument('--warm-dir', help='Directory of .puml/.dot/.mmd files to pre-render into the cache at startup')
     
     args = parser.parse_args()
+    if args.warm_dir:
+        os.environ['RENDER_CACHE_WARM_DIR'] = args.warm_dir
     
     if args.mcp:
         # Run in MCP stdio mode
+        graphviz_backend()
+        graphviz_inprocess()
+        start_cache_warmup()
         run_mcp_mode()
     else:
         # Run in HTTP mode
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a PlantUML server, for offline tests and benchmarks.
+
+Implements the endpoints render_plantuml uses:
+
+    GET  /{svg|png}/{key}          deflate + PlantUML-base64 encoded source
+    GET  /{svg|png}/{page}/{key}   one page of a diagram split with ``newpage``
+    POST /{svg|png}[/{page}]       plain-text source in the request body
+
+Instead of laying diagrams out it returns a small deterministic image that
+echoes the diagram lines, with configurable latency and error injection:
+
+    python plantuml_stub_server.py --port 8080 --latency 0.05 --error-rate 0.1
+    PLANTUML_SERVER=http://127.0.0.1:8080 python mcp_diagram_server.py
+"""
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from mcp_diagram_server import plantuml_server_key_to_text
+
+_PATH = re.compile(r'^/(svg|png)(?:/(\d+))?(?:/([0-9A-Za-z_-]+))?/?$')
+_NEWPAGE = re.compile(r'^[ \t]*newpage\b.*$', re.MULTILINE)
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def make_png(width: int, height: int) -> bytes:
+    """A blank white RGB PNG of the given size"""
+    row = b'\x00' + b'\xff' * (3 * width)
+    return (b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(row * height))
+            + _png_chunk(b'IEND', b''))
+
+
+def make_svg(lines, page: int) -> bytes:
+    """An SVG listing the diagram lines, so callers can tell renders apart"""
+    height = 20 * (len(lines) + 1)
+    body = ''.join(f'<text x="10" y="{20 * (i + 1)}">{escape(line)}</text>' for i, line in enumerate(lines))
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="400" height="{height}" data-page="{page}">'
+            f'{body}</svg>').encode('utf-8')
+
+
+def render_stub(text: str, format: str, page: int = 0) -> Tuple[int, bytes]:
+    """Return (status, image) for ``text``; unterminated diagrams and missing pages are 400s"""
+    start = re.search(r'@start(\w+)', text)
+    if start and f'@end{start.group(1)}' not in text:
+        return 400, make_svg(['Syntax Error?'], page) if format == 'svg' else make_png(1, 1)
+    pages = _NEWPAGE.split(text)
+    if page >= len(pages):
+        return 400, make_svg([f'No page {page}'], page) if format == 'svg' else make_png(1, 1)
+    lines = [line.strip() for line in pages[page].splitlines()
+             if line.strip() and not line.strip().startswith(('@start', '@end'))]
+    if format == 'svg':
+        return 200, make_svg(lines, page)
+    return 200, make_png(40, 10 * (len(lines) + 1))
+
+
+class PlantUMLStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like a real PlantUML server
+    disable_nagle_algorithm = True
+    server: 'PlantUMLStubServer'
+
+    def do_GET(self):
+        match = _PATH.match(self.path)
+        if not match or not match.group(3):
+            return self._reply(404, b'not found', 'text/plain')
+        try:
+            text = plantuml_server_key_to_text(match.group(3))
+        except Exception:
+            return self._reply(400, b'invalid diagram key', 'text/plain')
+        self._render(text, match.group(1), int(match.group(2) or 0))
+
+    def do_POST(self):
+        match = _PATH.match(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if not match or match.group(3):
+            return self._reply(404, b'not found', 'text/plain')
+        self._render(body.decode('utf-8', 'replace'), match.group(1), int(match.group(2) or 0))
+
+    def _render(self, text: str, format: str, page: int) -> None:
+        status = self.server.inject(format)
+        if status:
+            return self._reply(status, b'injected failure', 'text/plain')
+        status, image = render_stub(text, format, page)
+        self._reply(status, image, 'image/svg+xml' if format == 'svg' else 'image/png')
+
+    def _reply(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PlantUMLStubServer(ThreadingHTTPServer):
+    """Threaded stand-in server; use as a context manager to run it in the background.
+
+    latency: seconds added to every render (plus up to ``jitter`` more)
+    error_rate: fraction of renders answered with ``error_status`` instead
+    seed: makes the jitter and injected errors reproducible
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 seed: Optional[int] = 0):
+        super().__init__((host, port), PlantUMLStubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {'requests': 0, 'errors': 0}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def inject(self, format: str) -> int:
+        """Apply latency and decide whether this render fails; returns an error status or 0"""
+        with self._lock:
+            self.counts['requests'] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.counts['errors'] += 1
+        if delay:
+            time.sleep(delay)
+        return self.error_status if failed else 0
+
+    def start(self) -> 'PlantUMLStubServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='plantuml-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'PlantUMLStubServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local PlantUML server stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every render')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra seconds per render')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of renders that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status of injected failures')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    httpd = PlantUMLStubServer(args.host, args.port, args.latency, args.jitter,
+                               args.error_rate, args.error_status, args.seed)
+    print(f"PlantUML stand-in listening on {httpd.url}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,14 @@
+"""
+Shared fixtures for the test suite
+"""
+import pytest
+
+import mcp_diagram_server as server
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Give every test an empty cache so results do not leak between tests"""
+    monkeypatch.setattr(server, 'RENDER_CACHE', server.MemoryRenderCache(1024 * 1024))
+    monkeypatch.setattr(server, 'RENDER_CACHE_TIERS', [])
+    monkeypatch.setattr(server, 'RENDER_FAILURES', server.NegativeRenderCache(30))
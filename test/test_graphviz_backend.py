@@ -0,0 +1,417 @@
+"""
+Tests for the Graphviz rendering backend
+"""
+import ctypes.util
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+import mcp_diagram_server as server
+
+
+# Stands in for the dot binary: prints a version banner for -V, logs the flags
+# of every render, writes one "<format/>" output per -T (to its -o file when
+# given, "<format -n2/>" when reusing a layout), rejects sources containing
+# "syntax error" and takes a while over sources containing "slow".
+FAKE_DOT = r'''
+import os
+import sys
+import time
+args = sys.argv[1:]
+if args == ['-V']:
+    sys.stderr.write('dot - graphviz version 9.9.9 (fake)\n')
+    sys.exit(0)
+source = sys.stdin.read()
+with open(os.environ['FAKE_DOT_LOG'], 'a') as log:
+    log.write(' '.join(a for a in args if a.startswith('-') and a != '-o') + '\n')
+if 'syntax error' in source:
+    sys.stderr.write('Error: syntax error in line 1\n')
+    sys.exit(1)
+if 'slow' in source:
+    time.sleep(0.3)
+layout = ' -n2' if '-n2' in args else ''
+for i, arg in enumerate(args):
+    if arg.startswith('-T'):
+        data = f'<{arg[2:]}{layout}/>'
+        if args[i + 1:i + 2] == ['-o']:
+            with open(args[i + 2], 'w') as out:
+                out.write(data)
+        else:
+            sys.stdout.write(data)
+'''
+
+
+@pytest.fixture
+def fake_dot(tmp_path, monkeypatch):
+    script = tmp_path / 'dot'
+    script.write_text(f'#!{sys.executable}\n{FAKE_DOT}')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    log = tmp_path / 'renders.log'
+    log.write_text('')
+    monkeypatch.setenv('GRAPHVIZ_DOT', str(script))
+    monkeypatch.setenv('FAKE_DOT_LOG', str(log))
+    server.graphviz_backend.cache_clear()
+    yield log
+    server.graphviz_backend.cache_clear()
+
+
+def test_backend_is_resolved_once(fake_dot, monkeypatch):
+    lookups = []
+    real_which = shutil.which
+
+    def which(name, *args, **kwargs):
+        lookups.append(name)
+        return real_which(name, *args, **kwargs)
+
+    monkeypatch.setattr(shutil, 'which', which)
+    backend = server.graphviz_backend()
+    assert backend.kind == 'dot'
+    assert backend.path == os.environ['GRAPHVIZ_DOT']
+    assert 'graphviz version 9.9.9' in backend.version
+    for _ in range(3):
+        assert server.render_graphviz('digraph { a -> b }', format='svg') == b'<svg/>'
+    assert server.engine_version('graphviz') == backend.version
+    # one lookup for dot itself, one for its version banner
+    assert len(lookups) == 2
+
+
+def test_syntax_errors_render_once(fake_dot):
+    with pytest.raises(server.RenderError, match='syntax error'):
+        server.render_graphviz('digraph { syntax error }', format='svg')
+    assert fake_dot.read_text().splitlines() == ['-Tsvg']
+
+
+def test_missing_graphviz_is_reported(monkeypatch):
+    # python-graphviz may well be installed, but it needs the same missing binary
+    monkeypatch.setenv('GRAPHVIZ_DOT', '/nonexistent/dot')
+    server.graphviz_backend.cache_clear()
+    try:
+        assert server.graphviz_backend().kind == 'unavailable'
+        with pytest.raises(RuntimeError, match='graphviz not available'):
+            server.render_graphviz('digraph { a -> b }')
+    finally:
+        server.graphviz_backend.cache_clear()
+
+
+class FakeLibGVC:
+    version = '9.9.9'
+
+    def __init__(self):
+        self.sources = []
+
+    def render_many(self, dot_src, formats, timeout=None, engine='dot'):
+        self.sources.append(dot_src)
+        return {fmt: b'<svg>in-process</svg>' for fmt in formats}
+
+
+def test_small_graphs_render_in_process(fake_dot, monkeypatch):
+    lib = FakeLibGVC()
+    monkeypatch.setattr(server, 'graphviz_inprocess', lambda: lib)
+    monkeypatch.setattr(server, 'GRAPHVIZ_INPROCESS_MAX_BYTES', 64)
+    small = 'digraph { a -> b }'
+    large = 'digraph { ' + ' '.join(f'n{i} -> n{i + 1};' for i in range(20)) + ' }'
+    assert server.render_graphviz(small, format='svg') == b'<svg>in-process</svg>'
+    assert server.render_graphviz(large, format='svg') == b'<svg/>'
+    assert lib.sources == [small]
+    assert server.engine_version('graphviz').endswith('; libgvc 9.9.9')
+
+
+def test_missing_libgvc_falls_back_to_dot(fake_dot, monkeypatch):
+    monkeypatch.setattr(server, 'GRAPHVIZ_BACKEND', 'libgvc')
+    monkeypatch.setenv('GRAPHVIZ_LIBGVC', '/nonexistent/libgvc.so')
+    server.graphviz_inprocess.cache_clear()
+    try:
+        assert server.graphviz_inprocess() is None
+        assert server.render_graphviz('digraph { a -> b }', format='svg') == b'<svg/>'
+    finally:
+        server.graphviz_inprocess.cache_clear()
+
+
+# Stands in for libgvc_worker.py: speaks its protocol, hangs on sources
+# containing "slow", dies on "crash" and rejects "syntax error".
+FAKE_GVC_WORKER = r'''
+import os
+import sys
+import time
+sys.path.insert(0, os.environ['REPO_ROOT'])
+from libgvc_worker import read_message, write_message
+write_message(1, ('ready', '9.9.9'))
+while True:
+    request = read_message(0)
+    if request is None:
+        break
+    src, formats, engine = request
+    if b'slow' in src:
+        time.sleep(30)
+    if b'crash' in src:
+        os._exit(139)
+    if b'syntax error' in src:
+        write_message(1, ('error', 'dot failed: syntax error in line 1'))
+        continue
+    write_message(1, ('ok', {fmt: f'<{fmt} pid={os.getpid()}/>'.encode() for fmt in formats}))
+'''
+
+
+@pytest.fixture
+def fake_gvc(tmp_path, monkeypatch):
+    script = tmp_path / 'fake_gvc_worker.py'
+    script.write_text(FAKE_GVC_WORKER)
+    monkeypatch.setenv('REPO_ROOT', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setattr(server, 'LIBGVC_WORKER', str(script))
+    lib = server.LibGVC('libgvc.so', 'libcgraph.so')
+    yield lib
+    lib.close()
+
+
+def test_libgvc_worker_is_killed_at_the_deadline(fake_gvc):
+    first = fake_gvc.render('digraph { a -> b }', format='svg')
+    with pytest.raises(server.RenderTimeout):
+        fake_gvc.render('digraph { slow -> b }', format='svg', timeout=0.3)
+    # a fresh worker serves the next render instead of queueing behind the layout
+    started = time.monotonic()
+    second = fake_gvc.render('digraph { a -> b }', format='svg', timeout=10)
+    assert time.monotonic() - started < 5
+    assert second != first and fake_gvc.restarts == 1
+    with pytest.raises(server.RenderError, match='syntax error'):
+        fake_gvc.render('digraph { syntax error }', format='svg')
+    assert fake_gvc.version == '9.9.9'
+
+
+def test_libgvc_crashes_fall_back_to_dot(fake_gvc, fake_dot, monkeypatch):
+    monkeypatch.setattr(server, 'graphviz_inprocess', lambda: fake_gvc)
+    assert server.render_graphviz('digraph { crash -> b }', format='svg') == b'<svg/>'
+    assert server.render_graphviz('digraph { a -> b }', format='svg').startswith(b'<svg pid=')
+
+
+def test_libgvc_workers_render_side_by_side(fake_gvc, fake_dot, monkeypatch):
+    monkeypatch.setattr(server, 'graphviz_inprocess', lambda: fake_gvc)
+    monkeypatch.setattr(server, 'GRAPHVIZ_POOL', server.GraphvizProcessPool(4))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(fake_gvc.render, 'digraph { slow -> b }', 'svg', 1.0)
+        time.sleep(0.2)
+        # the only worker is busy, so the graph goes to dot at once
+        started = time.monotonic()
+        assert server.render_graphviz('digraph { a -> b }', format='svg') == b'<svg/>'
+        assert time.monotonic() - started < 0.5
+        assert fake_gvc.busy == 1
+        with pytest.raises(server.RenderTimeout):
+            slow.result()
+        fake_gvc.max_workers = 2
+        slow = executor.submit(fake_gvc.render, 'digraph { slow -> b }', 'svg', 1.0)
+        time.sleep(0.2)
+        # a second worker takes the small graph instead of queueing behind the layout
+        started = time.monotonic()
+        assert server.render_graphviz('digraph { a -> b }', format='svg').startswith(b'<svg pid=')
+        assert time.monotonic() - started < 0.5
+        with pytest.raises(server.RenderTimeout):
+            slow.result()
+
+
+def test_inprocess_limit_counts_bytes(fake_dot, monkeypatch):
+    lib = FakeLibGVC()
+    monkeypatch.setattr(server, 'graphviz_inprocess', lambda: lib)
+    monkeypatch.setattr(server, 'GRAPHVIZ_INPROCESS_MAX_BYTES', 25)
+    wide = 'digraph { "\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9" }'  # 22 characters, 30 bytes
+    assert len(wide) <= 25 < len(wide.encode('utf-8'))
+    assert server.render_graphviz(wide, format='svg') == b'<svg/>'
+    assert lib.sources == []
+
+
+@pytest.mark.skipif(not ctypes.util.find_library('gvc'), reason="libgvc not installed")
+def test_libgvc_renders_and_reports_syntax_errors():
+    lib = server.LibGVC()
+    assert b'<svg' in lib.render('digraph { a -> b }', format='svg')
+    with pytest.raises(server.RenderError):
+        lib.render('digraph { a -> }', format='svg')
+
+
+def test_formats_share_one_layout(fake_dot):
+    text = 'digraph { a -> b }'
+    formats, images = server.render_graphviz_tool(text, 'png', {'formats': 'svg, png'})
+    assert formats == ['svg', 'png']
+    assert [image.data for image in images] == [b'<svg/>', b'<png/>']
+    # one dot run also keeps the layout for later formats
+    assert fake_dot.read_text().splitlines() == ['-Tsvg -Tpng -Tdot']
+
+    response = server.handle_sse_call_tool(1, 'graphviz.render', {'text': text, 'formats': ['svg', 'png']})
+    content = response['result']['content']
+    assert content[0]['text'] == '2 diagrams rendered successfully as image/svg+xml, image/png'
+    assert [item.get('mimeType') for item in content[1:]] == ['image/svg+xml', 'image/png']
+    assert len(fake_dot.read_text().splitlines()) == 1
+
+
+def test_later_formats_reuse_the_cached_layout(fake_dot):
+    text = 'digraph { a -> b }'
+    server.render_graphviz_formats_cached(text, ['svg'])
+    assert server.render_cached('graphviz', text, 'pdf').data == b'<pdf -n2/>'
+    assert server.render_graphviz_formats_cached(text, ['png', 'svg'])[0].data == b'<png -n2/>'
+    assert fake_dot.read_text().splitlines() == ['-Tsvg -Tdot', '-Kneato -n2 -Tpdf', '-Kneato -n2 -Tpng']
+
+
+def test_concurrent_multi_format_requests_share_one_layout(fake_dot):
+    text = 'digraph { slow -> b }'
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(
+            lambda formats: server.render_graphviz_formats_cached(text, formats),
+            [['svg', 'png'], ['svg', 'png'], ['svg', 'png'], ['pdf']]))
+    assert [[image.data for image in images] for images in results[:3]] == [[b'<svg/>', b'<png/>']] * 3
+    assert results[3][0].data in (b'<pdf/>', b'<pdf -n2/>')
+    # one layout for the identical requests; pdf either led or reused the cached layout
+    renders = fake_dot.read_text().splitlines()
+    assert sum('-Tdot' in line for line in renders) == 1
+    assert len(renders) <= 2
+
+
+def test_formats_are_labelled_and_validated(fake_dot):
+    text = 'digraph { a -> b }'
+    response = server.handle_sse_call_tool(1, 'graphviz.render', {'text': text, 'formats': 'svg,pdf,dot'})
+    content = response['result']['content']
+    assert [item.get('mimeType') for item in content[1:]] == ['image/svg+xml', 'application/pdf',
+                                                             'text/vnd.graphviz']
+    for arguments in ({'formats': 'svg,../../x'}, {'format': 'gif'}):
+        response = server.handle_sse_call_tool(2, 'graphviz.render', dict(arguments, text=text))
+        assert response['error']['code'] == -32602
+        assert 'unsupported graphviz format' in response['error']['message']
+    response = server.handle_sse_call_tool(3, 'mermaid.render', {'text': 'graph TD\nA-->B', 'format': 'jpg'})
+    assert response['error']['code'] == -32602
+    response = TestClient(server.app).post('/call_tool', json={
+        'name': 'plantuml.render', 'arguments': {'text': 'A -> B', 'format': 'svg/../../x'}})
+    assert response.status_code == 400
+    assert 'unsupported plantuml format' in response.json()['detail']
+    assert len(fake_dot.read_text().splitlines()) == 1
+
+
+def test_multi_format_syntax_errors_are_negatively_cached(fake_dot):
+    for _ in range(2):
+        with pytest.raises(server.RenderError, match='syntax error'):
+            server.render_graphviz_formats_cached('digraph { syntax error }', ['svg', 'png'])
+    assert len(fake_dot.read_text().splitlines()) == 1
+
+
+def test_graph_size_counts_nodes_and_edges():
+    src = '''strict digraph G { // a -> b
+        graph [rankdir=LR]; node [shape=box, label="x -> y"];
+        a:p1 -> b -> c; "x y" -> d [color=red];
+        /* e -> f */
+        subgraph cluster_0 { e; f }
+    }'''
+    assert server.graphviz_graph_size(src) == (7, 3)
+
+
+def test_auto_engine_switches_to_sfdp_for_large_graphs(fake_dot, monkeypatch):
+    monkeypatch.setattr(server, 'GRAPHVIZ_AUTO_MAX_NODES', 5)
+    small = 'digraph { a -> b }'
+    large = 'digraph { ' + ' '.join(f'n{i} -> n{i + 1};' for i in range(10)) + ' }'
+    assert server.select_graphviz_engine(small, 'auto') == 'dot'
+    assert server.select_graphviz_engine(large, 'auto') == 'sfdp'
+    server.render_graphviz_tool(small, 'svg', {'engine': 'auto'})
+    server.render_graphviz_tool(large, 'svg', {'engine': 'auto'})
+    assert fake_dot.read_text().splitlines() == ['-Tsvg', '-Ksfdp -Tsvg']
+
+
+def test_default_engine_applies_to_every_render_path(fake_dot, monkeypatch):
+    monkeypatch.setattr(server, 'GRAPHVIZ_ENGINE', 'auto')
+    monkeypatch.setattr(server, 'GRAPHVIZ_AUTO_MAX_NODES', 5)
+    large = 'digraph { ' + ' '.join(f'n{i} -> n{i + 1};' for i in range(10)) + ' }'
+    key = server.plantuml_text_to_server_key(large)
+    response = TestClient(server.app).get(f'/render/graphviz/svg/{key}')
+    assert response.status_code == 200
+    assert fake_dot.read_text().splitlines() == ['-Ksfdp -Tsvg']
+    # tools/call and warm-up (plain render_cached) look up the same entry
+    server.render_graphviz_tool(large, 'svg', {})
+    server.render_cached('graphviz', large, 'svg')
+    assert fake_dot.read_text().splitlines() == ['-Ksfdp -Tsvg']
+
+
+def test_engines_are_cached_separately(fake_dot):
+    text = 'digraph { a -> b }'
+    for engine in ('dot', 'neato', 'neato'):
+        server.render_graphviz_tool(text, 'svg', {'engine': engine})
+    assert fake_dot.read_text().splitlines() == ['-Tsvg', '-Kneato -Tsvg']
+    # plain dot keys are unchanged, so existing cache entries and ETags stay valid
+    assert server.render_cache_key('graphviz', 'svg', text, variant='') == server.render_cache_key('graphviz', 'svg', text)
+
+
+def test_unknown_engine_is_rejected(fake_dot):
+    with pytest.raises(server.InvalidArguments, match='unknown graphviz engine'):
+        server.render_graphviz_tool('digraph { a -> b }', 'svg', {'engine': 'spring'})
+    arguments = {'text': 'digraph { a -> b }', 'engine': 'spring'}
+    response = TestClient(server.app).post('/call_tool', json={'name': 'graphviz.render', 'arguments': arguments})
+    assert response.status_code == 400
+    assert 'unknown graphviz engine' in response.json()['detail']
+    assert server.handle_sse_call_tool(1, 'graphviz.render', arguments)['error']['code'] == -32602
+    assert fake_dot.read_text() == ''
+
+
+def test_invalid_default_engine_fails_at_startup():
+    env = dict(os.environ, GRAPHVIZ_ENGINE='spring')
+    result = subprocess.run([sys.executable, '-c', 'import mcp_diagram_server'], env=env,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'GRAPHVIZ_ENGINE must be' in result.stderr
+
+
+def test_renders_beyond_the_pool_size_queue_within_their_deadline(monkeypatch):
+    pool = server.GraphvizProcessPool(1)
+    monkeypatch.setattr(server, 'GRAPHVIZ_POOL', pool)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.slot(5):
+            holding.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    assert holding.wait(5)
+    with pytest.raises(server.RenderTimeout, match='without a free slot'):
+        with pool.slot(0.1):
+            pass
+    assert pool.stats()['running'] == 1
+    threading.Timer(0.1, release.set).start()
+    with pool.slot(5) as remaining:
+        assert remaining < 5
+    worker.join()
+    stats = server.cache_stats()['graphviz_pool']
+    assert stats['renders'] == 2
+    assert stats['queue_timeouts'] == 1
+    assert stats['running'] == 0 and stats['queued'] == 0
+    assert stats['queue_wait_max_ms'] >= 50
+
+
+@pytest.mark.skipif(not hasattr(server.resource, 'prlimit'), reason="resource limits need prlimit")
+def test_dot_runs_under_resource_limits(monkeypatch, tmp_path):
+    pool = server.GraphvizProcessPool(2)
+    monkeypatch.setattr(server, 'GRAPHVIZ_RLIMIT_CPU', 1)
+    monkeypatch.setattr(server, 'GRAPHVIZ_RLIMIT_OUTPUT_MB', 3)
+    # like dot, the probe reads its input first, by which time the limits are set
+    probe = ('import resource, sys; sys.stdin.read(); print(resource.getrlimit(resource.RLIMIT_CPU)[0],'
+             ' resource.getrlimit(resource.RLIMIT_FSIZE)[0])')
+    _, out, _ = pool.run([sys.executable, '-c', probe], timeout=10, input=b'')
+    assert out.split() == [b'1', str(3 * 1024 * 1024).encode()]
+    # a runaway layout is stopped by its CPU limit and reported as a render error
+    with pytest.raises(server.RenderError, match='CPU time limit'):
+        pool.run([sys.executable, '-c', 'import sys; sys.stdin.read()\nwhile True: pass'], timeout=10, input=b'')
+    # so is an output file past GRAPHVIZ_RLIMIT_OUTPUT_MB
+    with pytest.raises(server.RenderError, match='output size limit'):
+        pool.run(['sh', '-c', 'read x; exec head -c 5000000 /dev/zero > "$0"', str(tmp_path / 'out')],
+                 timeout=10, input=b'\n')
+    assert pool.stats()['limit_kills'] == 2
+
+
+def test_dot_crash_is_not_a_limit_failure():
+    pool = server.GraphvizProcessPool(1)
+    with pytest.raises(RuntimeError, match='SIGSEGV') as e:
+        pool.run(['sh', '-c', 'kill -SEGV $$'], timeout=10)
+    assert not server.is_deterministic_failure(e.value)
+    assert pool.stats()['limit_kills'] == 0
@@ -4,6 +4,7 @@ Pytest test suite for MCP Diagram Server
 import pytest
 from fastapi.testclient import TestClient
 from mcp_diagram_server import app
+from plantuml_stub_server import PlantUMLStubServer
 import base64
 import json
 
@@ -11,6 +12,15 @@ import json
 client = TestClient(app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def plantuml_stand_in():
+    """Render PlantUML against a local stand-in so these tests run offline"""
+    with PlantUMLStubServer() as stub, pytest.MonkeyPatch.context() as mp:
+        mp.setenv("PLANTUML_SERVER", stub.url)
+        mp.delenv("PLANTUML_SERVERS", raising=False)
+        yield stub
+
+
 def test_list_tools():
     """Test the /list_tools endpoint"""
     response = client.post("/list_tools")
@@ -18,13 +28,14 @@ def test_list_tools():
     data = response.json()
     assert data["ok"] is True
     assert "tools" in data
-    assert len(data["tools"]) == 3
+    assert len(data["tools"]) == 4
     
     # Check tool names
     tool_names = [tool["name"] for tool in data["tools"]]
     assert "plantuml.render" in tool_names
     assert "graphviz.render" in tool_names
     assert "mermaid.render" in tool_names
+    assert "cache.admin" in tool_names
     
     # Check each tool has required fields
     for tool in data["tools"]:
@@ -64,7 +64,7 @@ def test_mcp_mode():
         assert data["id"] == 2
         assert "result" in data
         assert "tools" in data["result"]
-        assert len(data["result"]["tools"]) == 3
+        assert len(data["result"]["tools"]) == 4
         print("   ✅ Tools list passed")
         
         # Test 3: Ping
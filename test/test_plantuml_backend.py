@@ -0,0 +1,399 @@
+"""
+Tests for the PlantUML rendering backend
+"""
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+import mcp_diagram_server as server
+from plantuml_stub_server import PlantUMLStubServer
+
+
+class FakeResponse:
+    def __init__(self, content=b'<svg/>', status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.urls = []
+        self.posts = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        return FakeResponse()
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.posts.append((url, data))
+        return FakeResponse()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(server, '_plantuml_http', client)
+    monkeypatch.setenv('PLANTUML_SERVER', 'http://plantuml.test')
+    return client
+
+
+def test_http_client_is_shared_and_pooled(monkeypatch):
+    monkeypatch.setattr(server, '_plantuml_http', None)
+    first = server.plantuml_http_client()
+    assert server.plantuml_http_client() is first
+    assert first.get_adapter('https://www.plantuml.com')._pool_maxsize == server.PLANTUML_POOL_SIZE
+    server.close_plantuml_http_client()
+    assert server._plantuml_http is None
+
+
+def test_render_plantuml_uses_shared_client(fake_http):
+    text = '@startuml\nA -> B\n@enduml'
+    assert server.render_plantuml(text, format='svg') == b'<svg/>'
+    server.render_plantuml(text, format='png')
+    key = server.plantuml_text_to_server_key(text)
+    assert fake_http.urls == [f'http://plantuml.test/svg/{key}', f'http://plantuml.test/png/{key}']
+
+
+# Stands in for `java -jar plantuml.jar -pipe`: answers every @enduml with a
+# numbered SVG followed by the delimiter passed on the command line. Diagrams
+# containing "syntax error" also get PlantUML's error report, on stdout only
+# with -pipeNoStderr.
+FAKE_JAVA = r'''
+import sys
+delimiter = sys.argv[sys.argv.index('-pipedelimitor') + 1]
+count = 0
+source = ''
+for line in sys.stdin:
+    source += line
+    if line.strip() == '@enduml':
+        count += 1
+        if count > 1 and 'crash' in sys.argv[sys.argv.index('-jar') + 1]:
+            sys.exit(1)
+        sys.stdout.write(f'<svg>{count}</svg>\n')
+        if 'syntax error' in source:
+            report = sys.stdout if '-pipeNoStderr' in sys.argv else sys.stderr
+            report.write('ERROR\n2\nSyntax Error?\n')
+        sys.stdout.write(f'{delimiter}\n')
+        sys.stdout.flush()
+        source = ''
+'''
+
+
+@pytest.fixture
+def fake_java(tmp_path):
+    script = tmp_path / 'fake_java.py'
+    script.write_text(FAKE_JAVA)
+    return f'{sys.executable} {script}'
+
+
+def test_jvm_pool_reuses_warm_workers(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, max_renders=100, java=fake_java)
+    try:
+        # render 1 in each worker is the startup health check
+        assert pool.render('A -> B') == b'<svg>2</svg>'
+        assert pool.render('@startuml\nB -> C\n@enduml') == b'<svg>3</svg>'
+        assert pool.stats()['spawned'] == 1
+    finally:
+        pool.close()
+
+
+def test_jvm_pool_renders_only_the_first_block(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, java=fake_java)
+    try:
+        two = '@startuml\nA -> B\n@enduml\n@startuml\nsyntax error\n@enduml'
+        assert pool.render(two) == b'<svg>2</svg>'
+        assert pool.render('note\n' + two) == b'<svg>3</svg>'
+        # no output of the second blocks is left over for the next render
+        assert pool.render('X -> Y') == b'<svg>4</svg>'
+    finally:
+        pool.close()
+
+
+def test_jvm_pool_recycles_after_max_renders(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, max_renders=2, java=fake_java)
+    try:
+        assert pool.render('A -> B') == b'<svg>2</svg>'
+        assert pool.render('A -> B') == b'<svg>3</svg>'
+        assert pool.stats()['recycled'] == 1
+        assert pool.render('A -> B') == b'<svg>2</svg>'
+        assert pool.stats()['spawned'] == 2
+    finally:
+        pool.close()
+
+
+def test_jvm_pool_reports_syntax_errors(fake_java, monkeypatch):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, java=fake_java)
+    monkeypatch.setattr(server, 'plantuml_jvm_pool', lambda: pool)
+    try:
+        for _ in range(2):
+            with pytest.raises(server.RenderError, match='line 2: Syntax Error'):
+                server.render_cached('plantuml', 'A -> B\nsyntax error', 'svg')
+        outputs = pool.render_many(['A -> B', 'syntax error', 'B -> C'])
+        assert outputs[0] == b'<svg>3</svg>' and outputs[2] == b'<svg>5</svg>'
+        assert isinstance(outputs[1], server.RenderError)
+        # the same worker keeps serving: 1 health check, 1 failed render, 3 batch renders
+        assert pool.render('A -> B') == b'<svg>6</svg>'
+        assert pool.stats()['spawned'] == 1
+    finally:
+        pool.close()
+
+
+def test_split_plantuml_blocks():
+    doc = ('# Design\n\n```plantuml\n@startuml\nA -> B\n@enduml\n```\n\n'
+           '@startmindmap\n* root\n@endmindmap\ntrailing text')
+    assert server.split_plantuml_blocks(doc) == [
+        '@startuml\nA -> B\n@enduml',
+        '@startmindmap\n* root\n@endmindmap',
+    ]
+    assert server.split_plantuml_blocks('A -> B') == []
+
+
+def test_jvm_pool_renders_batch_through_one_worker(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=2, java=fake_java)
+    try:
+        texts = [f'@startuml\nA -> B{i}\n@enduml' for i in range(50)]
+        outputs = pool.render_many(texts)
+        assert outputs == [f'<svg>{i}</svg>'.encode() for i in range(2, 52)]
+        assert pool.stats()['spawned'] == 1
+    finally:
+        pool.close()
+
+
+def test_render_plantuml_batch_uses_shared_client(fake_http):
+    texts = ['@startuml\nA -> B\n@enduml', '@startuml\nB -> C\n@enduml']
+    assert server.render_plantuml_batch(texts) == [b'<svg/>', b'<svg/>']
+    keys = [server.plantuml_text_to_server_key(text) for text in texts]
+    assert sorted(fake_http.urls) == sorted(f'http://plantuml.test/svg/{key}' for key in keys)
+
+
+def test_render_plantuml_falls_back_to_server(fake_java, fake_http, monkeypatch):
+    # the fake exits on the first real render after its health check
+    pool = server.PlantUMLJVMPool('crash', size=1, java=fake_java)
+    monkeypatch.setattr(server, '_plantuml_jvm_pool', pool)
+    try:
+        assert server.render_plantuml('A -> B') == b'<svg/>'
+        assert len(fake_http.urls) == 1
+        assert pool.stats()['failures'] == 1
+        monkeypatch.setattr(server, 'PLANTUML_REMOTE_FALLBACK', False)
+        with pytest.raises(RuntimeError, match='exited'):
+            server.render_plantuml('A -> B')
+    finally:
+        pool.close()
+
+
+def test_jvm_pool_caps_workers_across_slots(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, java=fake_java, max_workers=2)
+    try:
+        pool.render('A -> B', format='svg')
+        pool.render('A -> B', format='png')
+        pool.render('A -> B\nnewpage\nB -> C', page=1)
+        # the longest idle worker (svg) made room for the page worker
+        stats = pool.stats()
+        assert stats['workers'] == {'png': 1, 'svg#1': 1}
+        assert stats['evicted'] == 1
+        assert stats['spawned'] == 3
+    finally:
+        pool.close()
+
+
+def test_jvm_pool_waits_when_every_worker_is_busy(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, java=fake_java, max_workers=1)
+    try:
+        busy = pool._acquire('svg', 5)
+        with pytest.raises(server.RenderTimeout):
+            pool._acquire('png', 0.2)
+        pool._release(busy, healthy=True)
+        assert pool.render('A -> B', format='png').startswith(b'<svg>2</svg>')
+        assert pool.stats()['workers'] == {'png': 1}
+    finally:
+        pool.close()
+
+
+def test_pages_use_indexed_server_urls(fake_http):
+    text = '@startuml\nA -> B\nnewpage\nB -> C\n@enduml'
+    server.render_plantuml(text, format='svg', page=1)
+    key = server.plantuml_text_to_server_key(text)
+    assert fake_http.urls == [f'http://plantuml.test/svg/1/{key}']
+
+
+def test_jvm_pool_keeps_page_workers_apart(fake_java):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, java=fake_java)
+    try:
+        pool.render('A -> B')
+        pool.render('A -> B\nnewpage\nB -> C', page=1)
+        assert pool.stats()['workers'] == {'svg': 1, 'svg#1': 1}
+    finally:
+        pool.close()
+
+
+def test_pages_beyond_the_worker_cap_go_to_the_server(fake_java, fake_http, monkeypatch):
+    pool = server.PlantUMLJVMPool('plantuml.jar', size=1, java=fake_java, max_workers=2)
+    monkeypatch.setattr(server, '_plantuml_jvm_pool', pool)
+    try:
+        short = '@startuml\nA -> B\nnewpage\nB -> C\n@enduml'
+        assert len(server.render_plantuml_pages(short, 'svg')) == 2
+        assert fake_http.urls == [] and pool.stats()['spawned'] == 2
+        long = '@startuml\n' + '\nnewpage\n'.join(f'P{i} -> Q' for i in range(5)) + '\n@enduml'
+        assert len(server.render_plantuml_pages(long, 'svg')) == 5
+        # page 0 reuses the warm plain worker; the other pages start no JVMs
+        key = server.plantuml_text_to_server_key(long)
+        assert sorted(fake_http.urls) == [f'http://plantuml.test/svg/{page}/{key}' for page in range(1, 5)]
+        assert pool.stats()['spawned'] == 2
+    finally:
+        pool.close()
+
+
+def test_large_diagrams_are_posted(fake_http, monkeypatch):
+    monkeypatch.setattr(server, 'PLANTUML_POST_THRESHOLD', 100)
+    small = '@startuml\nA -> B\n@enduml'
+    large = '@startuml\n' + '\n'.join(f'P{i} -> Q{i}: m{i}' for i in range(200)) + '\n@enduml'
+    server.render_plantuml(small, format='svg')
+    server.render_plantuml(large, format='png')
+    assert len(fake_http.urls) == 1
+    assert fake_http.posts == [('http://plantuml.test/png', large.encode('utf-8'))]
+
+
+def test_large_diagrams_are_posted_without_encoding(fake_http, monkeypatch):
+    monkeypatch.setattr(server, 'PLANTUML_POST_THRESHOLD', 100)
+    encoded = []
+    monkeypatch.setattr(server, 'plantuml_text_to_server_key', lambda text: encoded.append(text) or 'key')
+    large = '@startuml\n' + 'A -> B\n' * 50 + '@enduml'
+    server.render_plantuml(large, format='svg')
+    assert encoded == []
+    assert len(fake_http.posts) == 1
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f'{status} error', response=response)
+
+
+def test_balancer_prefers_least_outstanding_backend():
+    balancer = server.PlantUMLBalancer(['http://a', 'http://b'])
+    busy = balancer._pick()
+    assert balancer.request(lambda url: url) != busy.url
+    balancer._record(busy, 0.01, True)
+
+
+def test_balancer_ejects_failing_backend_and_retries_elsewhere():
+    balancer = server.PlantUMLBalancer(['http://a', 'http://b'], failure_threshold=2, eject_seconds=60)
+    calls = []
+
+    def fn(url):
+        calls.append(url)
+        if url == 'http://a':
+            raise requests.ConnectionError('refused')
+        return url
+
+    for _ in range(4):
+        assert balancer.request(fn) == 'http://b'
+    assert calls.count('http://a') == 2
+    backends = {b['url']: b for b in balancer.stats()['backends']}
+    assert backends['http://a']['ejected'] is True
+    assert backends['http://b']['ejected'] is False
+
+
+def test_balancer_does_not_blame_backends_for_bad_diagrams():
+    balancer = server.PlantUMLBalancer(['http://a', 'http://b'], failure_threshold=1)
+
+    def fn(url):
+        raise _http_error(400)
+
+    with pytest.raises(requests.HTTPError):
+        balancer.request(fn)
+    assert not any(b['ejected'] for b in balancer.stats()['backends'])
+    assert sum(b['requests'] for b in balancer.stats()['backends']) == 1
+
+
+def test_balancer_ejects_slow_backends():
+    balancer = server.PlantUMLBalancer(['http://a'], failure_threshold=1, slow_seconds=0.0)
+    balancer.request(lambda url: time.sleep(0.01))
+    assert balancer.stats()['backends'][0]['ejected'] is True
+    # with every backend ejected the balancer still fails open
+    assert balancer.request(lambda url: url) == 'http://a'
+
+
+def test_balancer_hedges_slow_requests():
+    balancer = server.PlantUMLBalancer(['http://a', 'http://b'], hedge_percentile=50)
+    try:
+        for backend in balancer.backends:
+            backend.latencies.extend([0.01] * 20)
+        release = threading.Event()
+
+        def fn(url):
+            if url == balancer.backends[0].url:
+                release.wait(5)
+            return url
+
+        assert balancer.request(fn) == 'http://b'
+        assert balancer.stats()['hedges'] == 1
+        release.set()
+    finally:
+        balancer.close()
+
+
+def test_render_plantuml_uses_configured_server_list(fake_http, monkeypatch):
+    monkeypatch.setenv('PLANTUML_SERVERS', 'http://one.test, http://two.test/')
+    server.render_plantuml('A -> B')
+    assert fake_http.urls[0].startswith('http://one.test/svg/')
+    assert server.engine_version('plantuml') == 'http://one.test,http://two.test'
+
+
+def test_server_timeouts_become_render_timeouts(fake_http, monkeypatch):
+    seen = []
+
+    def slow_get(url, timeout=None):
+        seen.append(timeout)
+        raise requests.Timeout('read timed out')
+
+    monkeypatch.setattr(fake_http, 'get', slow_get)
+    with pytest.raises(server.RenderTimeout):
+        server.render_plantuml('A -> B', timeout=3)
+    assert len(seen) == 1 and 0 < seen[0] <= 3
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    monkeypatch.setattr(server, '_plantuml_http', None)
+    with PlantUMLStubServer() as stub:
+        monkeypatch.setenv('PLANTUML_SERVER', stub.url)
+        yield stub
+    server.close_plantuml_http_client()
+
+
+def test_stand_in_decodes_keys_pages_and_posts(stand_in, monkeypatch):
+    text = '@startuml\nAlice -> Bob: hi\nnewpage\nBob -> Carol: <b>\n@enduml'
+    assert b'Alice -&gt; Bob: hi' in server.render_plantuml(text)
+    page = server.render_plantuml(text, page=1)
+    assert b'data-page="1"' in page and b'Bob -&gt; Carol: &lt;b&gt;' in page
+    assert server.render_plantuml(text, format='png').startswith(b'\x89PNG\r\n\x1a\n')
+    monkeypatch.setattr(server, 'PLANTUML_POST_THRESHOLD', 10)
+    assert b'Alice -&gt; Bob: hi' in server.render_plantuml(text)
+    assert stand_in.counts == {'requests': 4, 'errors': 0}
+
+
+def test_stand_in_injects_latency_and_errors(stand_in):
+    stand_in.error_rate = 1.0
+    with pytest.raises(requests.HTTPError) as info:
+        server.render_plantuml('A -> B')
+    assert info.value.response.status_code == 503
+    stand_in.error_rate = 0.0
+    stand_in.latency = 0.3
+    with pytest.raises(server.RenderTimeout):
+        server.render_plantuml('A -> B', timeout=0.1)
+
+
+def test_stand_in_rejects_unterminated_diagrams(stand_in):
+    with pytest.raises(requests.HTTPError) as info:
+        server.render_plantuml('@startuml\nA -> B')
+    assert server.is_deterministic_failure(info.value)
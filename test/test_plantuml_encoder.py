@@ -0,0 +1,90 @@
+"""
+Golden tests for the PlantUML text encoder
+"""
+import random
+
+import pytest
+
+import mcp_diagram_server as server
+
+_TABLE = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+
+
+def reference_encode(data: bytes) -> str:
+    """The original bit-shifting encoder, kept as the reference implementation"""
+    res = []
+    bit_buf = 0
+    bit_len = 0
+    for b in data:
+        bit_buf = (bit_buf << 8) | b
+        bit_len += 8
+        while bit_len >= 6:
+            bit_len -= 6
+            res.append(_TABLE[(bit_buf >> bit_len) & 0x3F])
+    if bit_len > 0:
+        res.append(_TABLE[(bit_buf << (6 - bit_len)) & 0x3F])
+    return ''.join(res)
+
+
+# Keys produced by the original implementation (the first is the one shown
+# on plantuml.com for this diagram)
+GOLDEN_KEYS = {
+    '@startuml\nAlice -> Bob: Hello\n@enduml': 'SoWkIImgAStDuNBCoKnELT2rKt3AJx9Iy4ZDoSddSaZDIm7A0G0',
+    'digraph G { A -> B }': 'IybCBqeio51mLwXMS5JGjLDmKgW500',
+    'graph TD\nA --> B': 'IozABCXG277XSbJGrRLJS080',
+    '': '0m0',
+}
+
+
+def _corpus():
+    rng = random.Random(1234)
+    yield b''
+    yield bytes(range(256))
+    yield b'\xff' * 7
+    for size in list(range(1, 17)) + [63, 64, 65, 1000, 4097, 65536]:
+        yield bytes(rng.getrandbits(8) for _ in range(size))
+
+
+@pytest.mark.parametrize('data', list(_corpus()), ids=lambda d: f'{len(d)}B')
+def test_encoder_matches_reference(data):
+    encoded = server._plantuml_encode(data)
+    assert encoded == reference_encode(data)
+    assert server._plantuml_decode(encoded) == data
+
+
+@pytest.mark.parametrize('text,key', GOLDEN_KEYS.items())
+def test_server_keys_are_unchanged(text, key):
+    assert server.plantuml_text_to_server_key(text) == key
+    assert server.plantuml_server_key_to_text(key) == text
+
+
+@pytest.mark.parametrize('key', ['abc+', 'abc/', 'ab=c', 'abcé'])
+def test_decoder_rejects_foreign_characters(key):
+    with pytest.raises(ValueError):
+        server._plantuml_decode(key)
+
+
+def test_deflate_level_is_configurable():
+    text = '\n'.join(f'A{i} -> B{i * 7 % 13}: message {i}' for i in range(500))
+    fast = server.plantuml_text_to_server_key(text, level=1)
+    best = server.plantuml_text_to_server_key(text, level=9)
+    assert len(best) < len(fast)
+    assert server.plantuml_server_key_to_text(fast) == text
+    assert server.plantuml_server_key_to_text(best) == text
+
+
+def test_server_keys_are_memoized():
+    text = '@startuml\nmemo -> test\n@enduml'
+    before = server._server_key.cache_info().hits
+    first = server.plantuml_text_to_server_key(text)
+    assert server.plantuml_text_to_server_key(text) is first
+    assert server._server_key.cache_info().hits == before + 1
+
+
+def test_large_sources_are_not_memoized(monkeypatch):
+    monkeypatch.setattr(server, 'PLANTUML_KEY_CACHE_MAX_CHARS', 32)
+    text = '@startuml\n' + 'large -> source\n' * 4 + '@enduml'
+    before = server._server_key.cache_info().currsize
+    key = server.plantuml_text_to_server_key(text)
+    assert server.plantuml_server_key_to_text(key) == text
+    assert server._server_key.cache_info().currsize == before
@@ -0,0 +1,574 @@
+"""
+Tests for the render cache in front of the diagram renderers
+"""
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import mcp_diagram_server as server
+from mcp_diagram_server import CacheKey, MemoryRenderCache, RenderedDiagram, app
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def fake_plantuml(monkeypatch):
+    """Replace the PlantUML renderer with a counting fake"""
+    calls = []
+
+    def render(text, format='svg', page=0, timeout=None):
+        calls.append((text, format))
+        return f'<svg>{len(calls)}</svg>'.encode('utf-8')
+
+    monkeypatch.setattr(server, 'render_plantuml', render)
+    return calls
+
+
+def _key(n: int) -> CacheKey:
+    return CacheKey('graphviz', 'png', f'{n:064x}', 'test')
+
+
+def test_memory_cache_hit_and_miss():
+    cache = MemoryRenderCache(100)
+    assert cache.get(_key(1)) is None
+    cache.put(_key(1), RenderedDiagram(b'abc'))
+    hit = cache.get(_key(1))
+    assert hit.data == b'abc'
+    assert hit.data_base64 == 'YWJj'
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    # raw and base64 forms are both charged to the budget
+    assert stats['bytes'] == 3 + 4
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryRenderCache(30)
+    for n in (1, 2):
+        cache.put(_key(n), RenderedDiagram(b'1234'))
+    cache.get(_key(1))
+    cache.put(_key(3), RenderedDiagram(b'1234'))
+    assert cache.get(_key(2)) is None
+    assert cache.get(_key(1)).data == b'1234'
+    assert cache.get(_key(3)).data == b'1234'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_cache_skips_oversized_entries():
+    cache = MemoryRenderCache(4)
+    cache.put(_key(1), RenderedDiagram(b'12345'))
+    assert cache.get(_key(1)) is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_cache_key_depends_on_format_and_source():
+    a = server.render_cache_key('plantuml', 'svg', 'A -> B')
+    assert a == server.render_cache_key('plantuml', 'svg', 'A -> B')
+    assert a != server.render_cache_key('plantuml', 'png', 'A -> B')
+    assert a != server.render_cache_key('plantuml', 'svg', 'A -> C')
+    assert a.id != server.render_cache_key('plantuml', 'png', 'A -> B').id
+
+
+def test_call_tool_serves_repeat_render_from_cache(fake_plantuml):
+    body = {'name': 'plantuml.render', 'arguments': {'text': '@startuml\nA -> B\n@enduml'}}
+    first = client.post('/call_tool', json=body).json()
+    second = client.post('/call_tool', json=body).json()
+    assert first['ok'] is True
+    assert first == second
+    assert len(fake_plantuml) == 1
+    assert base64.b64decode(second['result']['data_base64']) == b'<svg>1</svg>'
+
+
+def test_cache_is_shared_across_dispatch_paths(fake_plantuml):
+    args = {'text': '@startuml\nA -> B\n@enduml', 'format': 'svg'}
+    client.post('/call_tool', json={'name': 'plantuml.render', 'arguments': args})
+    response = server.handle_sse_call_tool(7, 'plantuml.render', args)
+    assert response['result']['content'][1]['data'] == base64.b64encode(b'<svg>1</svg>').decode('ascii')
+    assert len(fake_plantuml) == 1
+
+
+def test_disk_cache_persists_across_instances(tmp_path):
+    cache = server.DiskRenderCache(str(tmp_path), 1024)
+    cache.put(_key(1), b'png-bytes')
+    reopened = server.DiskRenderCache(str(tmp_path), 1024)
+    assert reopened.get(_key(1)) == b'png-bytes'
+    assert reopened.stats()['bytes'] == len(b'png-bytes')
+    assert not [p for p in tmp_path.rglob('.tmp-*')]
+
+
+def test_disk_cache_paths_ignore_the_client_format(tmp_path):
+    cache = server.DiskRenderCache(str(tmp_path / 'cache'), 1024)
+    key = CacheKey('graphviz', 'svg/../../../escaped', 'digest', 'v1')
+    cache.put(key, b'data')
+    assert cache.get(key) == b'data'
+    assert [p.name for p in tmp_path.iterdir()] == ['cache']
+    assert os.path.basename(cache._path(key)) == key.id
+
+
+def test_disk_cache_overwrites_do_not_inflate_its_size(tmp_path):
+    cache = server.DiskRenderCache(str(tmp_path), 1024)
+    for _ in range(3):
+        cache.put(_key(1), b'12345678')
+    assert cache._bytes == 8
+    assert cache.stats()['bytes'] == 8
+
+
+def test_disk_cache_evicts_oldest_files(tmp_path):
+    cache = server.DiskRenderCache(str(tmp_path), 10)
+    cache.put(_key(1), b'1234')
+    old_path = cache._path(_key(1))
+    os.utime(old_path, (1, 1))
+    cache.put(_key(2), b'1234')
+    cache.put(_key(3), b'1234')
+    assert cache.get(_key(1)) is None
+    assert cache.get(_key(3)) == b'1234'
+    assert cache.stats()['evictions'] >= 1
+
+
+def test_disk_tier_is_consulted_after_memory_miss(tmp_path, monkeypatch, fake_plantuml):
+    disk = server.DiskRenderCache(str(tmp_path), 1024 * 1024)
+    monkeypatch.setattr(server, 'RENDER_CACHE_TIERS', [disk])
+    server.render_cached('plantuml', 'A -> B', 'svg')
+    # simulate a restart: the in-memory tier is gone, the disk tier is not
+    monkeypatch.setattr(server, 'RENDER_CACHE', MemoryRenderCache(1024 * 1024))
+    assert server.render_cached('plantuml', 'A -> B', 'svg').data == b'<svg>1</svg>'
+    assert len(fake_plantuml) == 1
+    assert server.RENDER_CACHE.stats()['entries'] == 1
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'renders.db')
+    writer = server.SQLiteRenderCache(path, 1024)
+    reader = server.SQLiteRenderCache(path, 1024)
+    writer.put(_key(1), b'svg-bytes')
+    assert reader.get(_key(1)) == b'svg-bytes'
+    assert reader.get(_key(2)) is None
+    assert reader.stats()['entries'] == 1
+
+
+def test_sqlite_cache_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'renders.db')
+    caches = [server.SQLiteRenderCache(path, 1024 * 1024) for _ in range(4)]
+
+    def work(n):
+        cache = caches[n % len(caches)]
+        cache.put(_key(n), str(n).encode('ascii'))
+        return cache.get(_key(n))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(work, range(32)))
+    assert results == [str(n).encode('ascii') for n in range(32)]
+
+
+def test_sqlite_cache_evicts_least_recently_accessed(tmp_path):
+    cache = server.SQLiteRenderCache(str(tmp_path / 'renders.db'), 10)
+    for n in range(3):
+        cache.put(_key(n), b'1234')
+    assert cache.get(_key(0)) is None
+    assert cache.get(_key(2)) == b'1234'
+    assert cache.stats()['bytes'] <= 10
+
+
+def test_sqlite_cache_keeps_a_running_size(tmp_path):
+    path = str(tmp_path / 'renders.db')
+    cache = server.SQLiteRenderCache(path, 1024)
+    for _ in range(3):
+        cache.put(_key(1), b'12345678')
+    cache.put(_key(2), b'1234')
+    other = server.SQLiteRenderCache(path, 1024)
+    assert cache._total(cache._conn()) == other._total(other._conn()) == 12
+    other.purge(key_id=_key(1).id)
+    assert cache._total(cache._conn()) == 4
+
+
+def test_sqlite_cache_budget_holds_across_processes(tmp_path):
+    # one instance per uvicorn worker, all sharing the database
+    path = str(tmp_path / 'renders.db')
+    caches = [server.SQLiteRenderCache(path, 10000) for _ in range(8)]
+    peak = 0
+    for n in range(400):
+        caches[n % len(caches)].put(_key(n), b'x' * 500)
+        peak = max(peak, caches[0].stats()['bytes'])
+    assert peak <= 10000
+
+
+def test_concurrent_identical_renders_are_coalesced(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def slow_render(text, format='png', timeout=None):
+        calls.append(text)
+        release.wait(5)
+        return b'png'
+
+    monkeypatch.setattr(server, 'render_mermaid', slow_render)
+    monkeypatch.setattr(server, 'RENDER_FLIGHTS', server.SingleFlight())
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        futures = [pool.submit(server.render_cached, 'mermaid', 'graph TD\nA --> B', 'png') for _ in range(10)]
+        while server.RENDER_FLIGHTS.stats()['coalesced'] < 9:
+            time.sleep(0.01)
+        release.set()
+        results = [f.result() for f in futures]
+    assert all(r is results[0] for r in results)
+    assert results[0].data == b'png'
+    assert len(calls) == 1
+    assert server.RENDER_FLIGHTS.stats() == {'in_flight': 0, 'coalesced': 9}
+
+
+def test_coalesced_callers_share_the_error():
+    def fail():
+        raise RuntimeError('dot failed: syntax error')
+
+    flights = server.SingleFlight()
+    with pytest.raises(RuntimeError, match='dot failed'):
+        flights.do('k', fail)
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_failed_render_is_negatively_cached(monkeypatch):
+    calls = []
+
+    def broken_dot(text, format='png', timeout=None, engine='dot'):
+        calls.append(text)
+        raise server.RenderError('dot failed: syntax error in line 1')
+
+    monkeypatch.setattr(server, 'render_graphviz', broken_dot)
+    for _ in range(3):
+        with pytest.raises(server.RenderError, match='syntax error in line 1'):
+            server.render_cached('graphviz', 'digraph invalid {', 'svg')
+    assert len(calls) == 1
+    assert server.RENDER_FAILURES.stats()['renders_avoided'] == 2
+
+
+def test_transient_failures_are_not_negatively_cached(monkeypatch):
+    calls = []
+
+    def flaky(text, format='svg', page=0, timeout=None):
+        calls.append(text)
+        raise requests.ConnectionError('connection refused')
+
+    monkeypatch.setattr(server, 'render_plantuml', flaky)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            server.render_cached('plantuml', 'A -> B', 'svg')
+    assert len(calls) == 2
+
+
+def test_negative_cache_entries_expire(monkeypatch):
+    failures = server.NegativeRenderCache(0.05)
+    failures.put(_key(1), 'mmdc failed')
+    assert failures.get(_key(1)) == 'mmdc failed'
+    time.sleep(0.06)
+    assert failures.get(_key(1)) is None
+
+
+def test_negative_cache_error_reaches_http_client(monkeypatch):
+    def broken_dot(text, format='png', timeout=None, engine='dot'):
+        raise server.RenderError('dot failed: syntax error')
+
+    monkeypatch.setattr(server, 'render_graphviz', broken_dot)
+    body = {'name': 'graphviz.render', 'arguments': {'text': 'digraph {'}}
+    first = client.post('/call_tool', json=body).json()
+    second = client.post('/call_tool', json=body).json()
+    assert first == second == {'ok': False, 'error': 'dot failed: syntax error'}
+
+
+def test_plantuml_normalization_ignores_comments_wrappers_and_trailing_whitespace():
+    a = "@startuml\r\n' a comment\nAlice -> Bob: Hello   \r\n\r\nBob -> Alice\n@enduml\n"
+    b = "/' block\ncomment '/\nAlice -> Bob: Hello\n\nBob -> Alice"
+    assert server.normalize_source('plantuml', a) == server.normalize_source('plantuml', b)
+    # blank lines and indentation can matter inside notes
+    note = "note over Alice\n  indented\n\n\n  text\nend note"
+    assert server.normalize_source('plantuml', note) != \
+        server.normalize_source('plantuml', note.replace('  ', '').replace('\n\n\n', '\n\n'))
+
+
+@pytest.mark.parametrize('a, b', [
+    ("@startditaa\n+----+\n|  A |\n+----+\n@endditaa", "@startditaa\n+----+\n  |  A |\n+----+\n@endditaa"),
+    ("@startyaml\nroot:\n  child: 1\n@endyaml", "@startyaml\nroot:\nchild: 1\n@endyaml"),
+    ("@startyaml\na: 1\n' not a comment\n@endyaml", "@startyaml\na: 1\n@endyaml"),
+])
+def test_plantuml_normalization_keeps_non_uml_sources_verbatim(a, b):
+    assert server.normalize_source('plantuml', a) != server.normalize_source('plantuml', b)
+    assert server.render_cache_key('plantuml', 'svg', a) != server.render_cache_key('plantuml', 'svg', b)
+
+
+def test_dot_normalization_preserves_string_contents():
+    a = 'digraph G {\n  // layout\n  A   ->  B [label="two  spaces"]\n}\n'
+    b = 'digraph G {\nA -> B [label="two  spaces"]\n# 1 "generated"\n}'
+    c = 'digraph G {\nA -> B [label="two spaces"]\n}'
+    assert server.normalize_source('graphviz', a) == server.normalize_source('graphviz', b)
+    assert server.normalize_source('graphviz', a) != server.normalize_source('graphviz', c)
+
+
+def test_mermaid_normalization_keeps_directives_and_indentation():
+    a = '%%{init: {"theme": "dark"}}%%\ngraph TD\n  %% comment\n  A --> B  \n'
+    b = '%%{init: {"theme": "dark"}}%%\ngraph TD\n  A --> B'
+    assert server.normalize_source('mermaid', a) == server.normalize_source('mermaid', b)
+    assert server.normalize_source('mermaid', 'graph TD\nA --> B') != server.normalize_source('mermaid', b)
+    assert server.normalize_source('mermaid', 'mindmap\n  root\n    child') != \
+        server.normalize_source('mermaid', 'mindmap\n  root\n  child')
+
+
+def test_normalization_can_be_disabled(monkeypatch):
+    a, b = 'A -> B', "A -> B\n' comment"
+    assert server.render_cache_key('plantuml', 'svg', a) == server.render_cache_key('plantuml', 'svg', b)
+    monkeypatch.setattr(server, 'RENDER_CACHE_NORMALIZE', False)
+    assert server.render_cache_key('plantuml', 'svg', a) != server.render_cache_key('plantuml', 'svg', b)
+
+
+def test_server_key_roundtrip():
+    text = '@startuml\nAlice -> Bob: Hello ünïcode\n@enduml'
+    key = server.plantuml_text_to_server_key(text)
+    assert server.plantuml_server_key_to_text(key) == text
+
+
+def test_get_render_returns_cacheable_image(fake_plantuml):
+    key = server.plantuml_text_to_server_key('@startuml\nA -> B\n@enduml')
+    response = client.get(f'/render/plantuml/svg/{key}')
+    assert response.status_code == 200
+    assert response.content == b'<svg>1</svg>'
+    assert response.headers['content-type'] == 'image/svg+xml'
+    assert 'immutable' in response.headers['cache-control']
+    etag = response.headers['etag']
+
+    revalidated = client.get(f'/render/plantuml/svg/{key}', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['etag'] == etag
+    assert len(fake_plantuml) == 1
+
+
+def test_get_render_rejects_bad_requests():
+    key = server.plantuml_text_to_server_key('digraph { A -> B }')
+    assert client.get(f'/render/unknown/svg/{key}').status_code == 404
+    assert client.get(f'/render/graphviz/gif/{key}').status_code == 400
+    assert client.get('/render/graphviz/svg/not~valid').status_code == 400
+    truncated = key[:len(key) // 2]
+    with pytest.raises(ValueError, match='truncated'):
+        server.plantuml_server_key_to_text(truncated)
+    assert client.get(f'/render/graphviz/svg/{truncated}').status_code == 400
+
+
+def test_warmup_prerenders_corpus_directory(tmp_path, monkeypatch, fake_plantuml):
+    dot_calls = []
+
+    def fake_dot(text, format='png', timeout=None, engine='dot'):
+        dot_calls.append(format)
+        return b'png'
+
+    monkeypatch.setattr(server, 'render_graphviz', fake_dot)
+    (tmp_path / 'seq.puml').write_text('@startuml\nA -> B\n@enduml')
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'nested' / 'deps.dot').write_text('digraph { A -> B }')
+    (tmp_path / 'notes.txt').write_text('ignored')
+
+    warmup = server.CacheWarmup()
+    assert warmup.ready
+    warmup.start(str(tmp_path), concurrency=2).join(5)
+    assert warmup.ready
+    assert warmup.progress() == {
+        'directory': str(tmp_path), 'total': 2, 'done': 2, 'failed': 0, 'finished': True,
+    }
+    assert dot_calls == ['png']
+    assert server.render_cached('plantuml', '@startuml\nA -> B\n@enduml', 'svg').data == b'<svg>1</svg>'
+    assert len(fake_plantuml) == 1
+
+
+def test_ready_endpoint_reports_warmup_progress(monkeypatch):
+    warmup = server.CacheWarmup()
+    monkeypatch.setattr(server, 'CACHE_WARMUP', warmup)
+    assert client.get('/ready').status_code == 200
+    warmup.started = True
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.json()['ready'] is False
+
+
+def test_memory_cache_reports_engines_and_hottest_keys():
+    cache = MemoryRenderCache(1024)
+    hot = CacheKey('plantuml', 'svg', 'a' * 64, 'test')
+    cache.put(hot, RenderedDiagram(b'123456'))
+    cache.put(_key(1), RenderedDiagram(b'123'))
+    for _ in range(3):
+        cache.get(hot)
+    stats = cache.stats(top=1)
+    assert stats['engines'] == {
+        'plantuml': {'entries': 1, 'bytes': 6 + 8},
+        'graphviz': {'entries': 1, 'bytes': 3 + 4},
+    }
+    assert stats['top_keys'] == [{'key': hot.id, 'engine': 'plantuml', 'format': 'svg', 'bytes': 14, 'hits': 3}]
+    assert stats['hit_ratio'] == 1.0
+
+
+def test_purge_by_engine_and_key(tmp_path, monkeypatch):
+    disk = server.DiskRenderCache(str(tmp_path / 'disk'), 1024)
+    db = server.SQLiteRenderCache(str(tmp_path / 'renders.db'), 1024)
+    monkeypatch.setattr(server, 'RENDER_CACHE_TIERS', [disk, db])
+    puml = CacheKey('plantuml', 'svg', 'a' * 64, 'test')
+    for cache in (disk, db):
+        cache.put(puml, b'svg')
+        cache.put(_key(1), b'png')
+        cache.put(_key(2), b'png')
+    server.RENDER_CACHE.put(puml, RenderedDiagram(b'svg'))
+    server.RENDER_CACHE.put(_key(1), RenderedDiagram(b'png'))
+    server.RENDER_CACHE.put(_key(2), RenderedDiagram(b'png'))
+
+    assert server.purge_cache(key=_key(1).id) == {'memory': 1, 'tiers': [1, 1], 'negative': 0}
+    assert server.purge_cache(engine='graphviz') == {'memory': 1, 'tiers': [1, 1], 'negative': 0}
+    for cache in (disk, db):
+        assert cache.get(puml) == b'svg'
+        assert cache.get(_key(2)) is None
+    assert server.RENDER_CACHE.get(puml).data == b'svg'
+    assert server.RENDER_CACHE.get(_key(2)) is None
+    stats = server.cache_stats()
+    assert stats['memory']['engines'] == {'plantuml': {'entries': 1, 'bytes': 3 + 4}}
+    assert [t['engines'] for t in stats['tiers']] == [{'plantuml': {'entries': 1, 'bytes': 3}}] * 2
+
+
+def test_cache_admin_over_http_and_mcp(fake_plantuml):
+    client.post('/call_tool', json={'name': 'plantuml.render', 'arguments': {'text': 'A -> B'}})
+    stats = client.post('/cache_stats').json()['stats']
+    assert stats['memory']['engines']['plantuml']['entries'] == 1
+
+    response = server.handle_sse_call_tool(1, 'cache.admin', {'action': 'purge', 'engine': 'plantuml'})
+    purged = json.loads(response['result']['content'][0]['text'])
+    assert purged == {'purged': {'memory': 1, 'tiers': [], 'negative': 0}}
+
+    result = client.post('/call_tool', json={'name': 'cache.admin', 'arguments': {}}).json()
+    assert result['ok'] is True
+    assert result['result']['memory']['entries'] == 0
+    assert client.post('/cache_purge', json={}).json() == {
+        'ok': True, 'purged': {'memory': 0, 'tiers': [], 'negative': 0},
+    }
+
+
+def test_cache_hits_skip_base64_encoding(monkeypatch, fake_plantuml):
+    body = {'name': 'plantuml.render', 'arguments': {'text': 'A -> B'}}
+    first = client.post('/call_tool', json=body).json()
+
+    def fail(data):
+        raise AssertionError('cache hit re-encoded the image')
+
+    monkeypatch.setattr(server.base64, 'b64encode', fail)
+    assert client.post('/call_tool', json=body).json() == first
+    assert server.handle_sse_call_tool(1, 'plantuml.render', body['arguments'])['result']['content'][1]['data'] == \
+        first['result']['data_base64']
+
+
+@pytest.fixture
+def fake_plantuml_batch(monkeypatch):
+    """Replace the batch PlantUML renderer with a fake recording each batch"""
+    batches = []
+
+    def render(texts, format='svg', timeout=None):
+        batches.append(list(texts))
+        return [server.RenderError('Syntax Error?') if 'typo' in text
+                else f'<svg>{text.splitlines()[1]}</svg>'.encode('utf-8') for text in texts]
+
+    monkeypatch.setattr(server, 'render_plantuml_batch', render)
+    return batches
+
+
+def test_batch_renders_uncached_blocks_together(fake_plantuml_batch):
+    doc = '@startuml\nA\n@enduml\n\n@startuml\nB\n@enduml\n@startuml\nA\n@enduml'
+    images = server.render_plantuml_blocks(doc, 'svg')
+    assert [image.data for image in images] == [b'<svg>A</svg>', b'<svg>B</svg>', b'<svg>A</svg>']
+    # the repeated block is rendered once
+    assert fake_plantuml_batch == [['@startuml\nA\n@enduml', '@startuml\nB\n@enduml']]
+    server.render_plantuml_blocks(doc + '\n@startuml\nC\n@enduml', 'svg')
+    assert fake_plantuml_batch[1] == ['@startuml\nC\n@enduml']
+
+
+def test_batch_caches_good_blocks_when_one_fails(fake_plantuml_batch):
+    doc = ''.join(f'@startuml\n{name}\n@enduml\n' for name in ['A', 'B', 'typo', 'C'])
+    for _ in range(3):
+        with pytest.raises(server.RenderError, match='block 2: Syntax Error'):
+            server.render_plantuml_blocks(doc, 'svg')
+    # one render: the good blocks were cached and the bad one was cached as a failure
+    assert len(fake_plantuml_batch) == 1
+    assert server.RENDER_CACHE.stats()['entries'] == 3
+    assert server.RENDER_FAILURES.stats()['entries'] == 1
+
+
+def test_batch_tool_returns_one_image_per_block(fake_plantuml_batch):
+    doc = '@startuml\nA\n@enduml\n@startuml\nB\n@enduml'
+    body = client.post('/call_tool', json={
+        'name': 'plantuml.render', 'arguments': {'text': doc, 'batch': True}}).json()
+    assert body['ok'] is True
+    images = body['result']['images']
+    assert [base64.b64decode(image['data_base64']) for image in images] == [b'<svg>A</svg>', b'<svg>B</svg>']
+    assert body['result']['data_base64'] == images[0]['data_base64']
+
+    response = server.handle_sse_call_tool(1, 'plantuml.render', {'text': doc, 'batch': True})
+    content = response['result']['content']
+    assert content[0]['text'] == '2 diagrams rendered successfully as image/svg+xml'
+    assert [item['type'] for item in content] == ['text', 'image', 'image']
+    assert len(fake_plantuml_batch) == 1
+
+
+def test_split_pages_renders_and_caches_each_page(monkeypatch):
+    pages = []
+
+    def render(text, format='svg', page=0, timeout=None):
+        pages.append(page)
+        return f'<svg>page {page}</svg>'.encode('utf-8')
+
+    monkeypatch.setattr(server, 'render_plantuml', render)
+    doc = '@startuml\nA -> B\nnewpage\nB -> C\n  newpage Part 3\nC -> A\n@enduml'
+    assert server.count_plantuml_pages(doc) == 3
+    response = server.handle_sse_call_tool(1, 'plantuml.render', {'text': doc, 'split_pages': True})
+    images = [base64.b64decode(item['data']) for item in response['result']['content'][1:]]
+    assert images == [b'<svg>page 0</svg>', b'<svg>page 1</svg>', b'<svg>page 2</svg>']
+    assert sorted(pages) == [0, 1, 2]
+    server.render_plantuml_pages(doc, 'svg')
+    assert len(pages) == 3
+    # a single-page diagram keeps the plain cache entry
+    assert server.render_plantuml_pages('A -> B', 'svg')[0].data == b'<svg>page 0</svg>'
+
+
+def test_render_timeout_defaults_and_caps(monkeypatch):
+    monkeypatch.setitem(server.RENDER_TIMEOUTS, 'graphviz', 7.0)
+    monkeypatch.setattr(server, 'RENDER_TIMEOUT_MAX', 60.0)
+    assert server.render_timeout('graphviz') == 7.0
+    assert server.render_timeout('graphviz', '2.5') == 2.5
+    assert server.render_timeout('graphviz', 600) == 60.0
+    for bad in (0, -1, 'soon', float('nan'), [5]):
+        with pytest.raises(server.InvalidArguments, match='timeout must be a positive number'):
+            server.render_timeout('graphviz', bad)
+    response = client.post('/call_tool', json={
+        'name': 'graphviz.render', 'arguments': {'text': 'digraph { a -> b }', 'timeout': 'soon'}})
+    assert response.status_code == 400
+
+
+def test_renderer_subprocess_is_killed_at_deadline():
+    start = time.monotonic()
+    with pytest.raises(server.RenderTimeout, match='sleeper timed out'):
+        server._run_renderer([sys.executable, '-c', 'import time; time.sleep(30)'], 'sleeper', 0.3)
+    assert time.monotonic() - start < 5
+
+
+def test_timeouts_are_reported_distinctly_and_not_cached(monkeypatch):
+    timeouts = []
+
+    def hanging_dot(text, format='png', timeout=None, engine='dot'):
+        timeouts.append(timeout)
+        raise server.RenderTimeout(f'dot timed out after {timeout:g}s')
+
+    monkeypatch.setattr(server, 'render_graphviz', hanging_dot)
+    response = client.post('/call_tool', json={
+        'name': 'graphviz.render', 'arguments': {'text': 'digraph { a -> b }', 'timeout': 0.5}})
+    assert response.status_code == 504
+    assert response.json() == {'ok': False, 'error': 'dot timed out after 0.5s', 'timeout': True}
+
+    reply = server.handle_sse_call_tool(1, 'graphviz.render', {'text': 'digraph { a -> b }'})
+    assert reply['error']['code'] == -32001
+    assert timeouts == [0.5, server.RENDER_TIMEOUTS['graphviz']]
+    assert server.RENDER_FAILURES.stats()['entries'] == 0
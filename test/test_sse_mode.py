@@ -53,7 +53,7 @@ def test_sse_mode():
     assert data["id"] == 2
     assert "result" in data
     assert "tools" in data["result"]
-    assert len(data["result"]["tools"]) == 3
+    assert len(data["result"]["tools"]) == 4
     print("   ✅ Tools list passed")
     print(f"   Found {len(data['result']['tools'])} tools:")
     for tool in data["result"]["tools"]: